@@ -4,58 +4,314 @@ https://www.youtube.com/watch?v=sNa_uiqSlJo to get embeddings
 """
 
 import os.path
-import pandas as pd
-from pandas import DataFrame
+import threading
+from hashlib import sha256
+from time import sleep
+from typing import TYPE_CHECKING, NamedTuple
 
-from sentence_transformers import SentenceTransformer
-from voyager import Index, Space
+import numpy as np
+from voyager import Index
 
-from lyricDB import LyricDB
-from time import sleep
+import lyricPreprocess
+from catalog import Catalog
+from embeddingMatrix import EmbeddingMatrix
+from indexConfig import IndexConfig
+from indexStore import IndexStore
+from lyricDB import LyricDB, fts_query
+from searchBackend import ExactBackend, SearchBackend, VoyagerBackend
+
+# importing sentence_transformers pulls in torch and takes seconds, so it is only imported
+# when the model is first needed
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 type Row = tuple[str, str]
 type LyricSet = list[Row]
 type SongIDs = list[str]
 
 
+class IndexState(NamedTuple):
+    """A search backend with the catalog that maps its ids, swapped in and out as a unit"""
+
+    backend: SearchBackend
+    catalog: Catalog
+    # manifest version of a voyager index (0 if it was never saved), rows searched by an exact backend
+    version: int
+
+
 class Recommender:
-    def __init__(self, database: LyricDB) -> None:
-        self.indexPath = "./index.voy"
+    """
+    Constructing a Recommender is cheap. The model, index and id mapping are loaded the first
+    time they are used, or ahead of time by start_warm_up(). Loading is guarded by a lock so
+    concurrent request threads wait for one load instead of each starting their own.
+
+    Catalogs of up to config.exact_limit songs are searched exactly over the embedding matrix,
+    larger ones through a voyager index (see searchBackend.py).
+
+    Indexes saved by other processes (e.g. ingest.py) are picked up by reload() or the watch()
+    thread. The new index is loaded while requests keep querying the old one, then swapped in.
+    """
+
+    def __init__(self, database: LyricDB, directory: str = ".", config: IndexConfig | None = None) -> None:
+        # versioned index files and the embedding matrix live in directory
+        self.store = IndexStore(directory)
+        # graph parameters, distance and storage type of the index, see indexConfig.py
+        self.config = config if config is not None else IndexConfig.from_env()
+        # number of lyrics fed through the model per forward pass
+        self.batchSize = 64
 
         # get data
         self.lyrics: LyricDB = database
-        self.df: DataFrame = self.lyrics.get_df()
         # pretrained model to get embeddings
-        self.model: SentenceTransformer = SentenceTransformer("all-MiniLM-L6-v2")
+        self.modelName = "all-MiniLM-L6-v2"
+        self.dimensions = 384
+        # how stored vectors were made, the model and the lyric preprocessing. Cached vectors,
+        # the embedding matrix and indexes made any other way are recomputed
+        self.embeddingID = f"{self.modelName}+{lyricPreprocess.VERSION}"
+        # every catalog vector on disk, indexes are built from here
+        self.matrix = EmbeddingMatrix(os.path.join(directory, "embeddings"), self.dimensions, self.embeddingID)
+        # threads voyager may use to answer a batch of seed queries, -1 uses every core
+        self.numThreads = -1
 
-        self.index: Index = self.get_index()
-        self.recDF = self.df.copy()
-        self.recDF["score"] = None
+        self.__lock = threading.RLock()
+        self.__reloadLock = threading.Lock()
+        self.__model: "SentenceTransformer | None" = None
+        self.__state: IndexState | None = None
+        self.__warmUp: threading.Thread | None = None
+        self.__watcher: threading.Thread | None = None
 
-    def get_index(self) -> Index:
-        if os.path.isfile(self.indexPath):
-            self.index = Index.load(self.indexPath)
-            return self.update_index(self.index)
+    @property
+    def model(self) -> "SentenceTransformer":
+        if self.__model is None:
+            with self.__lock:
+                if self.__model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    self.__model = SentenceTransformer(self.modelName)
+        return self.__model
+
+    @property
+    def state(self) -> IndexState:
+        """
+        The current index and catalog. Read this once per request and use its fields, so a
+        hot swap in the middle of a request can't mix an old index with a new catalog.
+        """
+        if self.__state is None:
+            self.__load()
+        return self.__state
+
+    @property
+    def backend(self) -> SearchBackend:
+        return self.state.backend
+
+    @property
+    def catalog(self) -> Catalog:
+        """item_id -> Spotify id to translate query results"""
+        return self.state.catalog
 
+    @property
+    def version(self) -> str:
+        """Identifies the loaded index, changes whenever its contents do"""
+        state = self.state
+        return f"{state.backend.name}-{state.version}"
+
+    @property
+    def ready(self) -> bool:
+        """True once the index and id mapping are loaded and requests won't wait on them"""
+        return self.__state is not None
+
+    def __load(self) -> None:
+        with self.__lock:
+            if self.ready:
+                return
+            self.update_matrix()
+            if len(self.matrix) <= self.config.exact_limit:
+                backend, version = ExactBackend.from_matrix(self.matrix, self.config.space), len(self.matrix)
+            else:
+                backend = self.voyager(self.load_index())
+                manifest = self.store.current()
+                version = manifest["version"] if manifest else 0
+            # read after the backend so every id it can return is mapped
+            self.__state = IndexState(backend, Catalog.from_database(self.lyrics), version)
+
+    def warm_up(self) -> None:
+        """Load the model, index and id mapping now instead of on the first request"""
+        self.model
+        self.__load()
+
+    def start_warm_up(self) -> threading.Thread:
+        """Run warm_up() in a background thread so startup doesn't block on it"""
+        with self.__lock:
+            if self.__warmUp is None:
+                self.__warmUp = threading.Thread(target=self.warm_up, name="recommender-warm-up", daemon=True)
+                self.__warmUp.start()
+        return self.__warmUp
+
+    def reload(self) -> bool:
+        """
+        Swap in the index in the manifest if it is newer than the loaded one, or for a catalog
+        searched exactly, the embedding matrix if other processes added to it. The new backend
+        and catalog are loaded first while requests keep using the current state, then
+        replaced with one assignment. Returns True if a new backend was swapped in.
+        """
+        if not self.ready:
+            return False
+        with self.__reloadLock:
+            self.matrix.refresh()
+            exact = isinstance(self.__state.backend, ExactBackend)
+            if len(self.matrix) <= self.config.exact_limit:
+                if exact and len(self.matrix) == self.__state.version:
+                    return False
+                backend = ExactBackend.from_matrix(self.matrix, self.config.space)
+                self.__state = IndexState(backend, Catalog.from_database(self.lyrics), len(self.matrix))
+                print(f"Switched to exact search over {len(backend)} songs")
+                return True
+
+            manifest = self.store.current()
+            if manifest is None or (not exact and manifest["version"] <= self.__state.version):
+                return False
+            if not self.compatible(manifest):
+                print(f"Index version {manifest['version']} was built with other settings, not switching to it")
+                return False
+            try:
+                index = self.store.load(manifest)
+            except (OSError, RuntimeError, ValueError) as e:
+                print(f"Error loading index version {manifest['version']}: ({e})")
+                return False
+            self.__state = IndexState(self.voyager(index), Catalog.from_database(self.lyrics), manifest["version"])
+            print(f"Switched to index version {manifest['version']} ({len(index)} songs)")
+            return True
+
+    def watch(self, interval: float = 30.0) -> threading.Thread:
+        """Check for a newer index every interval seconds in a background thread"""
+
+        def poll():
+            while True:
+                sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Error while checking for a new index: ({e})")
+
+        with self.__lock:
+            if self.__watcher is None:
+                self.__watcher = threading.Thread(target=poll, name="recommender-index-watch", daemon=True)
+                self.__watcher.start()
+        return self.__watcher
+
+    def voyager(self, index: Index) -> VoyagerBackend:
+        return VoyagerBackend(index, self.config, self.numThreads)
+
+    def get_index(self) -> Index:
         # first i need to get embeddings using pretrained model
-        embedding_arr = self.model.encode(self.df["plainLyrics"])
-        # print(embedding_arr.shape)
+        self.update_matrix()
+        return self.load_index()
+
+    def load_index(self) -> Index:
+        """The saved index brought up to date with the embedding matrix, or a new one if there is none"""
+        manifest = self.store.current()
+        if manifest and self.compatible(manifest):
+            try:
+                return self.update_index(self.store.load(manifest))
+            except (OSError, RuntimeError, ValueError) as e:
+                print(f"Error loading index version {manifest['version']}, rebuilding: ({e})")
+        return self.rebuild_index()
+
+    def update_matrix(self, chunk_size: int = 4096) -> None:
+        """
+        Embed every row of the lyric table the embedding matrix does not have yet.
+        Rows are streamed from the database chunk_size at a time and each chunk's missing rows
+        are encoded as a single batch, so memory use is bounded by the chunk and not the table.
+        """
+        # pick up rows ingest.py or embed.py added since the matrix was mapped, so they aren't re-encoded
+        self.matrix.refresh()
+        added = 0
+        for rows in self.lyrics.iter_lyrics(chunk_size):
+            missing = set(self.matrix.missing(row[0] for row in rows))
+            if len(missing) == 0:
+                continue
+            rows = [row for row in rows if row[0] in missing]
+            self.matrix.append([row[0] for row in rows], self.encode([row[2] or "" for row in rows]))
+            added += len(rows)
+        if added > 0:
+            print(f"Embedded {added} new songs")
 
+    def rebuild_index(self, chunk_size: int = 4096) -> Index:
+        """
+        Build a new index from the embedding matrix. Vectors are streamed from the memory
+        mapped file chunk_size rows at a time so memory use stays flat whatever the catalog size.
+        """
         # voyager index stores and manages the vectors
         # kinda like a dictionary that points the ids to vectors
-        index = Index(Space.Euclidean, num_dimensions=384)
-        index.add_items(vectors=embedding_arr, ids=self.df["item_id"])
+        index = self.config.build(self.dimensions, max_elements=max(len(self.matrix), 1))
+        for ids, vectors in self.matrix.iter_chunks(chunk_size):
+            index.add_items(vectors=np.asarray(vectors), ids=ids.tolist())
+        # voyager can't load an empty index back, build it again next time instead
+        if len(index) > 0:
+            self.save_index(index)
         return index
 
-    def update_index(self, index: Index) -> Index:
-        for row in self.lyrics.get_all():
-            # if the id is not in index, add data
-            if row[0] not in index:
-                embed = self.model.encode(row[1])
-                index.add_item(vector=embed, id=self.df["item_id"])
-        index.save("./index.voy")
+    def compatible(self, manifest: dict) -> bool:
+        """True if the index a manifest describes was built by this model with these index settings"""
+        return (
+            manifest.get("model") == self.embeddingID
+            and manifest["dimensions"] == self.dimensions
+            and manifest.get("config") == self.config.params()
+        )
+
+    def update_index(self, index: Index, chunk_size: int = 4096) -> Index:
+        """Add every vector in the embedding matrix the index does not have yet"""
+        indexed = set(index.ids)
+        missing = [item_id for item_id in self.matrix.ids.tolist() if item_id not in indexed]
+        if len(missing) == 0:
+            return index
+
+        for start in range(0, len(missing), chunk_size):
+            ids, vectors = self.matrix.get(missing[start : start + chunk_size])
+            index.add_items(vectors=vectors, ids=ids.tolist())
+        print(f"Added {len(missing)} new songs to the index")
+        self.save_index(index)
         return index
 
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed lyrics as a (len(texts), dimensions) float32 array. Each text is cleaned first (see
+        lyricPreprocess.py). Vectors are cached in the database under a hash of the cleaned text
+        and embeddingID, so only text the model has never seen (and each distinct text only
+        once) goes through the model.
+        """
+        texts = [lyricPreprocess.clean(text) for text in texts]
+        hashes = [sha256(text.encode()).hexdigest() for text in texts]
+        cached = self.lyrics.get_embeddings(set(hashes), self.embeddingID)
+        missing = {h: text for h, text in zip(hashes, texts) if h not in cached}
+        if len(missing) > 0:
+            vectors = self.embed(list(missing.values()))
+            new = [(h, vec.tobytes()) for h, vec in zip(missing, vectors)]
+            self.lyrics.insert_embeddings(self.embeddingID, new)
+            cached.update(new)
+        if len(hashes) == 0:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return np.stack([np.frombuffer(cached[h], dtype=np.float32) for h in hashes])
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Run texts through the model. They are cut to the model's token window and sorted by
+        token count into batches of batchSize, so each batch is padded to about the length of
+        its own texts, and the vectors are returned in the order of texts.
+        """
+        model = self.model
+        # the window includes the [CLS] and [SEP] tokens the model adds
+        texts, lengths = lyricPreprocess.fit_window(model.tokenizer, texts, model.max_seq_length - 2)
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for batch in lyricPreprocess.length_batches(lengths, self.batchSize):
+            vectors[batch] = model.encode([texts[i] for i in batch], batch_size=len(batch))
+        return vectors
+
+    def save_index(self, index: Index) -> None:
+        """Save index as a new version, written atomically and recorded in the manifest"""
+        manifest = self.store.save(index, model=self.embeddingID, config=self.config.params())
+        print(f"Saved index version {manifest['version']} ({manifest['rows']} songs)")
+
     """ Index.query()
     Query this index to retrieve the k nearest neighbors of the provided vectors.
 
@@ -76,41 +332,177 @@ class Recommender:
         If multiple query vectors were provided, both neighbor_ids and distances will be of shape (num_queries, k), ordered such that the i-th result corresponds with the i-th query vector.
     """
 
-    def search(self, lyrics: str, k: int = 20) -> DataFrame:
-        """Search the index using song lyrics and get back k nearest neighbors"""
+    def search_text(self, text: str, k: int = 20, match: str = "all") -> list[tuple[int, str, float]]:
+        """
+        Keyword search, (item_id, Spotify id, bm25) of the k lyrics that best match text (see
+        fts_query for match). Answered by the full-text index alone, without the model or index
+        """
+        return self.lyrics.search_text(fts_query(text, match), k)
+
+    def search(
+        self, lyrics: str, k: int = 20, mode: str = "semantic", alpha: float = 0.5, candidates: int = 100
+    ) -> list[tuple[int, str, float]]:
+        """
+        Search the catalog using song lyrics and get back (item_id, Spotify id, score) of the k
+        best matches, where a lower score is better.
+
+        mode:
+            "semantic": nearest neighbors of the embedded lyrics, score is the distance
+            "keyword": search_text() for songs containing every word, skips the model, score is bm25
+            "rerank": the backend's `candidates` nearest neighbors reranked by fusing their
+                distance with how well their lyrics match the words of the query (bm25)
+            "prefilter": the `candidates` best bm25 matches ranked by fusing bm25 with their
+                distance to the query, computed exactly from the embedding matrix without
+                querying the backend
+        alpha weighs the fused scores, 1 is distance only and 0 bm25 only.
+        """
+        if mode == "keyword":
+            return self.search_text(lyrics, k)
+        if mode not in ("semantic", "rerank", "prefilter"):
+            raise ValueError(f"Unknown search mode: {mode}")
         # take our input song lyrics and embed
-        vec = self.model.encode(lyrics)
+        vec = self.encode([lyrics])[0]
+        state = self.state
+
+        if mode == "prefilter":
+            matches = self.lyrics.search_text(fts_query(lyrics, "any"), candidates)
+            spotify = {item_id: id for item_id, id, _ in matches}
+            bm25 = {item_id: score for item_id, _, score in matches}
+            # only songs that have been embedded can be compared with the query
+            ids, vectors = self.matrix.get([item_id for item_id, _, _ in matches])
+            distances = ExactBackend(ids, vectors, self.config.space).distances(vec[None])[0]
+            scores = self.fuse(distances, np.array([bm25[i] for i in ids.tolist()]), alpha)
+            top = np.argsort(scores, kind="stable")[:k]
+            return [(item_id, spotify[item_id], score) for item_id, score in zip(ids[top].tolist(), scores[top].tolist())]
+
         # limit to k here to save computing power and discard low scores
-        # BUG this shit don't work
-        ids, distances = self.index.query(vec, k)
-        results = pd.DataFrame(
-            [{"item_id": i, "score": d} for i, d in zip(ids, distances)]
-        )
-        # adds column for score into copy of self.df
-        return self.df.merge(results, on="item_id", how="inner")
+        ids, distances = state.backend.query(vec, k if mode == "semantic" else max(k, candidates))
+        # rows deleted from the database since the index was built can't be shown
+        known = state.catalog.contains(ids)
+        ids, distances = ids[known].astype(np.int64), distances[known]
+        if mode == "rerank":
+            matches = self.lyrics.search_text(fts_query(lyrics, "any"), len(ids), item_ids=ids.tolist())
+            bm25 = {item_id: score for item_id, _, score in matches}
+            distances = self.fuse(distances, np.array([bm25.get(i, np.nan) for i in ids.tolist()]), alpha)
+            top = np.argsort(distances, kind="stable")[:k]
+            ids, distances = ids[top], distances[top]
+        return list(zip(ids.tolist(), state.catalog.spotify(ids), distances.tolist()))
+
+    @staticmethod
+    def fuse(distances: np.ndarray, bm25: np.ndarray, alpha: float = 0.5) -> np.ndarray:
+        """
+        Combine distances and bm25 scores (nan where there was no keyword match) into one score
+        where lower is better. Each is scaled to 0 (best) .. 1 (worst) over the candidates first,
+        since distances and bm25 are on unrelated scales. A missing bm25 counts as the worst.
+        """
+
+        def scale(x: np.ndarray) -> np.ndarray:
+            low, high = np.nanmin(x, initial=np.inf), np.nanmax(x, initial=-np.inf)
+            scaled = (x - low) / (high - low) if high > low else np.zeros_like(x)
+            return np.nan_to_num(scaled, nan=1.0)
+
+        return alpha * scale(np.asarray(distances, dtype=np.float64)) + (1 - alpha) * scale(np.asarray(bm25, dtype=np.float64))
+
+    def score(
+        self, vectors: np.ndarray, k: int = 20, method: str = "sum", backend: SearchBackend | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Query the backend (the current one unless given) with every seed vector at once and combine the distances per item_id.
+        Returns (item_ids, scores) where a lower score is a better match.
+
+        method:
+            "sum" / "mean": total or average distance over all seeds. A candidate missing from a
+                seed's top k counts as that seed's k-th distance, the closest it could have been
+            "min": distance to the closest seed
+            "rrf": reciprocal rank fusion, sum of 1 / (60 + rank) over seeds, negated
+        """
+        backend = backend if backend is not None else self.backend
+        ids, distances = backend.query(np.atleast_2d(vectors), k)
+        k = ids.shape[1]
+        candidates, inverse = np.unique(ids, return_inverse=True)
+        inverse = inverse.reshape(ids.shape)
 
-    def store_score(self, lyrics: str) -> None:
-        """Take one song's lyrics and store the similarity scores"""
-        self.recDF["score"] += self.search(lyrics)["score"]
+        if method == "min":
+            scores = np.full(len(candidates), np.inf, dtype=np.float32)
+            np.minimum.at(scores, inverse.ravel(), distances.ravel())
+        elif method == "rrf":
+            ranks = np.broadcast_to(1.0 / (60 + np.arange(1, k + 1)), ids.shape)
+            scores = -np.bincount(inverse.ravel(), weights=ranks.ravel(), minlength=len(candidates))
+        elif method in ("sum", "mean"):
+            matrix = np.repeat(distances[:, -1:], len(candidates), axis=1)
+            matrix[np.arange(len(ids))[:, None], inverse] = distances
+            scores = matrix.sum(axis=0) if method == "sum" else matrix.mean(axis=0)
+        else:
+            raise ValueError(f"Unknown scoring method: {method}")
+        return candidates, scores
 
-    def get_recommendations(self, data: LyricSet|None = None, n: int = 10) -> SongIDs:
+    def seed_vectors(self, data: LyricSet, state: IndexState | None = None) -> np.ndarray:
         """
-        Returns list of Spotify song ids for those with lowest score (distance).
+        Vectors of the (id, lyrics) seed rows in data, in order. Seeds already in the catalog
+        reuse the vector the backend stores under their item_id, only the rest are encoded, in
+        one batch, so returning users' playlists mostly skip the model.
+        """
+        state = state if state is not None else self.state
+        item_ids = state.catalog.find(row[0] for row in data)
+        stored_ids, stored = state.backend.get_vectors(item_ids[item_ids >= 0])
+        position = {item_id: i for i, item_id in enumerate(stored_ids.tolist())}
+        hits = [i for i, item_id in enumerate(item_ids.tolist()) if item_id in position]
+        misses = [i for i, item_id in enumerate(item_ids.tolist()) if item_id not in position]
+        vectors = np.empty((len(data), self.dimensions), dtype=np.float32)
+        if len(hits) > 0:
+            vectors[hits] = stored[[position[int(item_ids[i])] for i in hits]]
+        if len(misses) > 0:
+            vectors[misses] = self.encode([data[i][1] or "" for i in misses])
+        return vectors
+
+    def get_recommendations(self, data: LyricSet|None = None, n: int = 10, method: str = "sum") -> SongIDs:
+        """
+        Returns list of Spotify song ids for those with lowest score (distance) to the
+        (id, lyrics) seed rows in data, leaving out the seeds themselves. All seed vectors are
+        sent to the search backend as one multi-vector query.
         Future iterations would do song sound analysis to get tempo, key, etc and recommend scores
         more effectively
         """
-        if data:
-            for row in data:
-                self.store_score(row[1])
-        # get lowest score
-        self.recDF.sort_values("score")
-        return [row[2] for row in self.recDF.iloc[:n].itertuples(name=None)]
+        state = self.state
+        if not data or len(state.backend) == 0:
+            return []
+        vectors = self.seed_vectors(data, state)
+        # seeds in the catalog match themselves at distance 0, ask for enough to drop them
+        item_ids, scores = self.score(vectors, k=max(20, 2 * n) + len(data), method=method, backend=state.backend)
+        seeds = state.catalog.find(row[0] for row in data)
+        keep = state.catalog.contains(item_ids) & ~np.isin(item_ids, seeds)
+        item_ids, scores = item_ids[keep], scores[keep]
+        # get lowest score without sorting every candidate
+        if n < len(scores):
+            top = np.argpartition(scores, n)[:n]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])]
+        return state.catalog.spotify(item_ids[top])
+
+    def nearest(self, vector: np.ndarray, n: int = 10, exclude: SongIDs | None = None) -> SongIDs:
+        """
+        Spotify ids of the n catalog songs nearest to one vector, e.g. a taste profile, with a
+        single query. Songs in exclude (e.g. the playlist's own) are left out.
+        """
+        state = self.state
+        if len(state.backend) == 0:
+            return []
+        exclude = state.catalog.find(exclude or [])
+        # only songs in the catalog can come back from the index, so only they need extra room
+        exclude = exclude[exclude >= 0]
+        ids, _ = state.backend.query(np.asarray(vector, dtype=np.float32), max(20, 2 * n) + len(exclude))
+        # results are nearest first, drop rows deleted from the database since the index was built
+        keep = state.catalog.contains(ids) & ~np.isin(ids, exclude)
+        return state.catalog.spotify(ids[keep][:n])
 
 
 if __name__ == "__main__":
     db = LyricDB()
     rec = Recommender(db)
-    for test1 in db.get_lyric_all()[:10]:
-        rec.store_score(test1[1])
-    for test in rec.get_recommendations(db.get_lyric_all()[10:15]):
-        print(test)
+    print(rec.search(db.get_lyric_all()[0][1], k=5))
+    print(rec.search_text("love", k=5))
+    for mode in ("rerank", "prefilter"):
+        print(mode, rec.search(db.get_lyric_all()[0][1], k=5, mode=mode))
+    for method in ("sum", "mean", "min", "rrf"):
+        print(method, rec.get_recommendations(db.get_lyric_all()[10:15], method=method))
@@ -1,8 +1,11 @@
 from typing import Any
 
 class Node():
+    # no per-node __dict__, lists and stacks can hold thousands of these
+    __slots__ = ("value", "next")
+
     def __init__(self, value=None, next=None):
-        self.next: Node|None = None
+        self.next: Node|None = next
         self.value: Any = value
 
     def __repr__(self):
@@ -17,6 +20,8 @@ class Node():
 class LinkedList():
     def __init__(self):
         self.head: Node|None = None
+        # last node so append doesn't walk the whole list
+        self.tail: Node|None = None
         self.__size: int = 0
 
     def __repr__(self):
@@ -30,10 +35,14 @@ class LinkedList():
 
     def __len__(self) -> int:
         """ Return number of nodes in LinkedList"""
-        if self.head and self.__size == 0:
-            self.__recount()
         return self.__size
-    
+
+    def __iter__(self):
+        current = self.head
+        while current is not None:
+            yield current.value
+            current = current.next
+
     def __getitem__(self, index) -> Any:
         if self.head:
             current = self.head
@@ -45,49 +54,31 @@ class LinkedList():
                     raise IndexError
             return current.value
         raise IndexError
-    
-    def __recount(self) -> int:
-        self.__size = 0
-        current = self.head
-        while current is not None:
-            self.__size += 1
-            current = current.next
-        return self.__size
 
     def prepend(self, val) -> None: 
         aNode = Node()
         aNode.value = val
         aNode.next, self.head = self.head, aNode
+        if self.tail is None:
+            self.tail = aNode
         self.__size += 1
 
     def append(self, val) -> None:
         if (type(val) is list) or (type(val) is tuple):
-            i = 0
-            if self.head is None:
-                self.head = Node(val[i])
-                i += 1
-            current = self.head
-            while current.next is not None:
-                current = current.next
-            while i < len(val):
-                self.__size += 1
-                current.next = Node(val[i])
-                current = current.next
+            for item in val:
+                self.append(item)
             return
-        else:
-            aNode = Node(val)
-            if self.head:
-                current = self.head
-                while current.next is not None:
-                    current = current.next
-                current.next = aNode
-                self.__size += 1
-                return
+        aNode = Node(val)
+        if self.tail is None:
             self.head = aNode
+        else:
+            self.tail.next = aNode
+        self.tail = aNode
+        self.__size += 1
     
     def insertAfter(self, index, val) -> None:
         if self.head is None:
-            self.head = Node(val)
+            self.append(val)
             return
         current = self.head
         i = 0
@@ -99,6 +90,8 @@ class LinkedList():
         aNode = Node(val)
         aNode.next = current.next
         current.next = aNode
+        if current is self.tail:
+            self.tail = aNode
         self.__size += 1
 
     def remove(self, index) -> Any:
@@ -115,7 +108,9 @@ class LinkedList():
             self.head = current.next
         else:
             prev.next = current.next
-            self.__size -= 1
+        if current is self.tail:
+            self.tail = prev
+        self.__size -= 1
         return current.value
 
     # precondition: give me a target that can be evaluated with == operator against the data
@@ -147,5 +142,5 @@ if __name__ == "__main__":
     a.insertAfter(1,7)
     print(a)
     a.remove(3)
-    print(a)
+    print(a, len(a))
     
\ No newline at end of file
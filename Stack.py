@@ -1,18 +1,6 @@
 from typing import Any
 
-class Node:
-    def __init__(self, value=None, next=None):
-        self.next: Node|None = None
-        self.value: Any = value
-
-    def __repr__(self):
-        output = f"{self.value} -> "
-        current = self.next
-        while current is not None:
-            output += f"{current.value} -> "
-            current = current.next
-        output += "None"
-        return output
+from SinglyLinkedList import Node
 
 class Stack:
     def __init__(self):
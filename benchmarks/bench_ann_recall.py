@@ -0,0 +1,103 @@
+"""
+Recall against latency for Voyager index settings. Each setting in the grid is built over the
+same vectors and queried with the same seeds, and its results are compared with the exact
+brute-force backend (searchBackend.ExactBackend) in the same space (INDEX_SPACE). Reports build
+time, index size, per-query latency and recall@k.
+
+Vectors come from the embedding matrix of the local database (embedded first if needed, which
+loads the model) or, with --synthetic N, from N random clustered unit vectors.
+
+uv run ./benchmarks/bench_ann_recall.py [--db lyrics.db] [--index-dir .] [--synthetic 20000]
+"""
+
+import argparse
+import itertools
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+from voyager import Space, StorageDataType
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from indexConfig import IndexConfig
+from searchBackend import ExactBackend
+
+
+def local_vectors(db: str, directory: str) -> tuple[np.ndarray, np.ndarray]:
+    from lyricDB import LyricDB
+    from Recommender import Recommender
+
+    database = LyricDB(db)
+    recommender = Recommender(database, directory)
+    recommender.update_matrix()
+    database.close()
+    matrix = recommender.matrix
+    return np.asarray(matrix.ids), np.asarray(matrix.vectors)
+
+
+def synthetic_vectors(n: int, dimensions: int = 384, clusters: int = 50) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dimensions))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dimensions))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.arange(n, dtype=np.int64), vectors.astype(np.float32)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found.tolist(), truth.tolist())]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="lyrics.db")
+    parser.add_argument("--index-dir", default=".")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of the database")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--space", nargs="+", default=["Cosine", "Euclidean", "InnerProduct"], choices=Space.__members__)
+    parser.add_argument("--M", type=int, nargs="+", default=[12, 32])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--query-ef", type=int, nargs="+", default=[20, 50, 200])
+    parser.add_argument("--storage", nargs="+", default=["Float32", "Float8", "E4M3"], choices=StorageDataType.__members__)
+    args = parser.parse_args()
+
+    ids, vectors = synthetic_vectors(args.synthetic) if args.synthetic > 0 else local_vectors(args.db, args.index_dir)
+    if len(ids) <= args.k:
+        sys.exit(f"Need more than {args.k} vectors, found {len(ids)}")
+    rng = np.random.default_rng(1)
+    # seeds are catalog songs with a little noise, like a playlist song that is almost in the catalog
+    queries = vectors[rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False)]
+    queries = (queries + 0.05 * rng.normal(size=queries.shape)).astype(np.float32)
+
+    print(f"{len(ids)} vectors, {len(queries)} queries, k={args.k}")
+    print(
+        f"{'space':>12} {'exact':>10} {'storage':>8} {'M':>4} {'ef_c':>5} {'query_ef':>9} "
+        f"{'build':>8} {'size':>9} {'latency':>10} {'recall':>7}"
+    )
+    for space in args.space:
+        # ground truth is measured the way this space measures distance
+        exact = ExactBackend(ids, vectors, Space.__members__[space])
+        start = perf_counter()
+        truth = exact.query(queries, args.k)[0]
+        exactTime = (perf_counter() - start) / len(queries)
+        for storage, M, efConstruction in itertools.product(args.storage, args.M, args.ef_construction):
+            config = IndexConfig(Space.__members__[space], M, efConstruction, storage=StorageDataType.__members__[storage])
+            start = perf_counter()
+            index = config.build(vectors.shape[1], max_elements=len(ids))
+            index.add_items(vectors, ids=ids.tolist())
+            build = perf_counter() - start
+            size = len(index.as_bytes()) / 2**20
+            for queryEf in args.query_ef:
+                config = config._replace(query_ef=queryEf)
+                start = perf_counter()
+                # one query at a time, the way a single search request sees it
+                found = np.stack([index.query(q, args.k, query_ef=config.ef(args.k))[0] for q in queries])
+                latency = (perf_counter() - start) / len(queries)
+                print(
+                    f"{space:>12} {exactTime * 1000:>8.3f}ms {storage:>8} {M:>4} {efConstruction:>5} {queryEf:>9} "
+                    f"{build:>7.2f}s {size:>7.1f}MB {latency * 1000:>8.3f}ms {recall(found, truth):>7.3f}"
+                )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Time fetching lyrics for a batch of songs from a local stub LRCLIB server that adds latency
+and random 429/500 errors. Compares one requests.get per song (the old Song.get_lyrics path)
+with LyricFetcher's pooled, rate limited, concurrent fetch.
+
+uv run ./benchmarks/bench_lyric_fetcher.py [--songs 200] [--latency 0.05] [--error-rate 0.1]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from lyricDB import LyricDB
+from lyricFetcher import LyricFetcher
+from stubs import StubLRCLIB
+
+
+def make_songs(n: int) -> list[dict]:
+    return [
+        {
+            "id": f"track{i}",
+            "name": f"missing {i}" if i % 10 == 0 else f"song {i}",
+            "artists": [{"name": f"artist {i % 7}"}],
+            "album": f"album {i % 13}",
+            "duration_ms": 180000 + i,
+            "lyrics": None,
+        }
+        for i in range(n)
+    ]
+
+
+def fetch_serial(url: str, songs: list[dict]) -> int:
+    """One unpooled request per song with no retry, like the old Song.get_lyrics"""
+    found = 0
+    for song in songs:
+        try:
+            response = requests.get(
+                f"{url}/api/get",
+                params={
+                    "artist_name": song["artists"][0]["name"],
+                    "track_name": song["name"],
+                    "album_name": song["album"],
+                    "duration": song["duration_ms"] // 1000,
+                },
+            )
+            if response.status_code == 200:
+                found += 1
+        except requests.RequestException:
+            pass
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--songs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=100.0)
+    args = parser.parse_args()
+
+    songs = make_songs(args.songs)
+    with StubLRCLIB(args.latency, args.error_rate) as stub, tempfile.TemporaryDirectory() as tmp:
+        start = perf_counter()
+        serial_found = fetch_serial(stub.url, songs)
+        serial = perf_counter() - start
+
+        db = LyricDB(os.path.join(tmp, "bench.db"))
+        fetcher = LyricFetcher(
+            db, base_url=stub.url, max_workers=args.workers, rate=args.rate, burst=args.workers, backoff=0.05
+        )
+        stub.requests = 0
+        start = perf_counter()
+        found = fetcher.fetch_many(songs)
+        pooled = perf_counter() - start
+        cached = len(db.lookup_many(song["id"] for song in songs).unknown)
+        fetcher.close()
+        db.close()
+
+    print(f"songs: {args.songs}  latency: {args.latency}s  error rate: {args.error_rate}")
+    print(f"serial:  {serial:8.2f}s  {serial_found} with lyrics")
+    print(f"fetcher: {pooled:8.2f}s  {sum(1 for v in found.values() if v)} with lyrics, "
+          f"{len(found)} resolved, {stub.requests} requests incl. retries, {cached} left uncached")
+    print(f"speedup: {serial / pooled:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Time lookups by Spotify ID on a synthetic lyrics table before and after the unique index on id
+(LyricDB migration 1). The table is built with the original schema (no index, some duplicate
+ids) in a temporary database and queried through a plain sqlite3 connection. Opening it with
+LyricDB runs the migrations, then the same queries run again on the same connection, so only the
+index differs between the two timings.
+
+uv run ./benchmarks/bench_lyric_lookup.py [--rows 1000000] [--duplicates 0.01]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from lyricDB import LyricDB
+
+
+def spotify_id(n: int) -> str:
+    return f"{n:022d}"
+
+
+def build(path: str, rows: int, duplicates: float) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE lyrics(item_id INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, plainLyrics TEXT)")
+    text = "".join(random.choices(string.ascii_lowercase + " \n", k=400))
+    connection.executemany(
+        "INSERT INTO lyrics(id, plainLyrics) VALUES (?, ?)",
+        # some ids are stored again, the way INSERT or IGNORE let them be without a unique index
+        ((spotify_id(random.randrange(n) if n and random.random() < duplicates else n), text) for n in range(rows)),
+    )
+    connection.commit()
+    connection.close()
+
+
+def time_single(search, ids: list[str]) -> float:
+    start = perf_counter()
+    for id in ids:
+        search(id)
+    return (perf_counter() - start) / len(ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--duplicates", type=float, default=0.01, help="fraction of rows repeating an earlier id")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=50, help="ids per lookup_many call, a playlist's worth")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lookup.db")
+        start = perf_counter()
+        build(path, args.rows, args.duplicates)
+        print(f"Built {args.rows} rows in {perf_counter() - start:.1f}s")
+        ids = [spotify_id(random.randrange(args.rows)) for _ in range(args.lookups)]
+        batch = ids[: args.batch]
+
+        connection = sqlite3.connect(path)
+        single = "SELECT plainLyrics FROM lyrics WHERE id = ?"
+        many = f"SELECT id, plainLyrics FROM lyrics WHERE id IN ({','.join('?' * len(batch))})"
+
+        def time_many() -> float:
+            start = perf_counter()
+            connection.execute(many, batch).fetchall()
+            return perf_counter() - start
+
+        # full scans are slow, a handful is enough to time them
+        before = time_single(lambda id: connection.execute(single, (id,)).fetchone(), ids[:10])
+        beforeMany = time_many()
+
+        start = perf_counter()
+        LyricDB(path).close()
+        migration = perf_counter() - start
+        rows = connection.execute("SELECT COUNT(*) FROM lyrics").fetchone()[0]
+        after = time_single(lambda id: connection.execute(single, (id,)).fetchone(), ids)
+        afterMany = time_many()
+        connection.close()
+
+    print(f"Migration took {migration:.2f}s, {args.rows - rows} duplicate rows removed")
+    print(f"{'':>22} {'before':>12} {'after':>12}")
+    print(f"{'single id':>22} {before * 1000:>10.3f}ms {after * 1000:>10.3f}ms")
+    print(f"{f'IN ({len(batch)} ids)':>22} {beforeMany * 1000:>10.3f}ms {afterMany * 1000:>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Per-lookup latency of LyricDB.search_lyric using the pooled per-thread connection
+compared with the old path that opened and closed a sqlite3 connection on every call.
+
+uv run ./benchmarks/bench_lyricdb_connections.py [--rows 5000] [--lookups 20000]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from lyricDB import LyricDB
+
+
+def search_connect_per_call(dbName: str, id: str) -> str | None:
+    """Lookup the way LyricDB did it before the connection pool"""
+    connection = sqlite3.connect(dbName)
+    with connection:
+        response = connection.execute(
+            'SELECT plainLyrics FROM lyrics WHERE "id" = (?)', [id]
+        ).fetchall()
+    connection.close()
+    if len(response) > 0:
+        return response[0][0]
+
+
+def time_lookups(lookup, ids: list[str]) -> float:
+    """Return mean seconds per lookup"""
+    start = perf_counter()
+    for id in ids:
+        lookup(id)
+    return (perf_counter() - start) / len(ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = LyricDB(os.path.join(tmp, "bench.db"))
+        db.insert_lyric_many(
+            [{"id": f"track{i}", "plainLyrics": f"lyrics {i} " * 40} for i in range(args.rows)]
+        )
+        ids = [f"track{random.randrange(args.rows)}" for _ in range(args.lookups)]
+
+        old = time_lookups(lambda id: search_connect_per_call(db.dbName, id), ids)
+        new = time_lookups(lambda id: db.search_lyric({"id": id}), ids)
+        db.close()
+
+    print(f"rows: {args.rows}  lookups: {args.lookups}")
+    print(f"connect per call: {old * 1e6:10.1f} us/lookup")
+    print(f"pooled:           {new * 1e6:10.1f} us/lookup")
+    print(f"speedup:          {old / new:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
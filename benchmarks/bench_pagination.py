@@ -0,0 +1,75 @@
+"""
+Time reading a large playlist and a long playlist listing from a local fake Spotify API
+server, page by page one after another versus pagination.iter_items fetching pages
+concurrently after the first.
+
+uv run ./benchmarks/bench_pagination.py [--tracks 5000] [--playlists 1000] [--latency 0.05]
+"""
+
+import argparse
+import os
+import sys
+from time import perf_counter
+
+from spotipy import Spotify
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from pagination import iter_items
+from stubs import StubSpotify
+
+
+def serial_items(fetch_page, limit: int) -> list:
+    """Read pages one after another until an empty one, like the old loops in main.py"""
+    items = []
+    offset = 0
+    while True:
+        page = fetch_page(offset, limit)
+        if len(page["items"]) == 0:
+            return items
+        items.extend(page["items"])
+        offset += limit
+
+
+def compare(name: str, fetch_page, limit: int, workers: int, expected: int) -> None:
+    start = perf_counter()
+    serial = serial_items(fetch_page, limit)
+    serialTime = perf_counter() - start
+    start = perf_counter()
+    concurrent = list(iter_items(fetch_page, limit, max_workers=workers))
+    concurrentTime = perf_counter() - start
+    assert serial == concurrent and len(concurrent) == expected, "pages came back out of order"
+    print(
+        f"{name:<16} {expected:>6} items  serial {serialTime:6.2f}s  concurrent {concurrentTime:6.2f}s  "
+        f"speedup {serialTime / concurrentTime:5.1f}x"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--playlists", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with StubSpotify(args.tracks, args.playlists, args.latency) as stub:
+        sp = Spotify(auth="benchmark", retries=0)
+        sp.prefix = stub.url + "/v1/"
+        compare(
+            "playlist tracks",
+            lambda offset, limit: sp.playlist_tracks("bench", offset=offset, limit=limit),
+            100,
+            args.workers,
+            args.tracks,
+        )
+        compare(
+            "user playlists",
+            lambda offset, limit: sp.current_user_playlists(offset=offset, limit=limit),
+            50,
+            args.workers,
+            args.playlists,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Time sorting a user's playlists by name for /playlists. Compares PlaylistLinkedList.msort_pls_key
+with the previous implementation, which built every merged list by appending to a head-only
+linked list (walking to the tail on each append) and so was quadratic.
+
+uv run ./benchmarks/bench_playlist_sort.py [--sizes 500 2000 5000 20000]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+from time import perf_counter
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+from stubs import offline_app
+
+offline_app()
+from main import PlaylistLinkedList
+
+
+class OldNode:
+    def __init__(self, value):
+        self.value = value
+        self.next = None
+
+
+class OldList:
+    """The previous head-only list and merge sort, kept here for comparison"""
+
+    def __init__(self):
+        self.head = None
+
+    def __len__(self):
+        n = 0
+        current = self.head
+        while current:
+            n += 1
+            current = current.next
+        return n
+
+    def append(self, val):
+        aNode = OldNode(val)
+        if self.head is None:
+            self.head = aNode
+            return
+        current = self.head
+        while current.next is not None:
+            current = current.next
+        current.next = aNode
+
+    def msort_pls_key(self, key):
+        if len(self) <= 1:
+            return
+        mid = len(self) // 2
+        left = OldList()
+        left.head = self.head
+        current = self.head
+        prev = None
+        for _ in range(mid):
+            prev, current = current, current.next
+        right = OldList()
+        right.head = current
+        prev.next = None
+        left.msort_pls_key(key)
+        right.msort_pls_key(key)
+        result = OldList()
+        l, r = left.head, right.head
+        while l and r:
+            if l.value[key].lower() <= r.value[key].lower():
+                result.append(l.value)
+                l = l.next
+            else:
+                result.append(r.value)
+                r = r.next
+        while l:
+            result.append(l.value)
+            l = l.next
+        while r:
+            result.append(r.value)
+            r = r.next
+        self.head = result.head
+
+
+def make_playlists(n: int) -> list[dict]:
+    return [
+        {"name": "".join(random.choices(string.ascii_letters + " ", k=16)), "id": str(i)}
+        for i in range(n)
+    ]
+
+
+def time_sort(cls, playlists: list[dict]) -> tuple[float, list[str]]:
+    pls = cls()
+    for pl in playlists:
+        pls.append(pl)
+    start = perf_counter()
+    pls.msort_pls_key(key="name")
+    elapsed = perf_counter() - start
+    names = []
+    current = pls.head
+    while current:
+        names.append(current.value["name"])
+        current = current.next
+    return elapsed, names
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000, 20000])
+    parser.add_argument("--old-limit", type=int, default=5000, help="skip the quadratic sort above this size")
+    args = parser.parse_args()
+
+    print(f"{'playlists':>10} {'old':>10} {'new':>10}")
+    for n in args.sizes:
+        playlists = make_playlists(n)
+        new, names = time_sort(PlaylistLinkedList, playlists)
+        assert names == sorted((pl["name"] for pl in playlists), key=str.casefold)
+        old = f"{time_sort(OldList, playlists)[0]:9.3f}s" if n <= args.old_limit else "skipped"
+        print(f"{n:>10} {old:>10} {new:>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the raw encode path (plainLyrics straight into SentenceTransformer.encode) with the
+preprocessed one Recommender uses (lyricPreprocess: cleaned, cut to the token window and batched
+by token length). Reports rows/sec and tokens per song of each, and how far the embeddings
+drift: cosine similarity between each song's two vectors and how many of its 10 nearest
+neighbors stay the same. Neither path uses the embedding cache.
+
+uv run ./benchmarks/bench_preprocess.py [--db example.db] [--limit 2000]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import lyricPreprocess
+from lyricDB import LyricDB
+from Recommender import Recommender
+from searchBackend import ExactBackend
+
+
+def neighbor_overlap(a: np.ndarray, b: np.ndarray, k: int = 10) -> float:
+    """Average share of each row's k nearest neighbors in a that are also among them in b"""
+    ids = np.arange(len(a))
+    k = min(k + 1, len(a))
+    nearA = ExactBackend(ids, a).query(a, k)[0]
+    nearB = ExactBackend(ids, b).query(b, k)[0]
+    # the first neighbor of every row is itself
+    return float(np.mean([len(set(x[1:]) & set(y[1:])) / max(k - 1, 1) for x, y in zip(nearA.tolist(), nearB.tolist())]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="example.db")
+    parser.add_argument("--limit", type=int, default=2000, help="songs to encode")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # LyricDB migrates the file it opens, work on a copy so example.db stays untouched
+        shutil.copy(args.db, os.path.join(tmp, "lyrics.db"))
+        database = LyricDB(os.path.join(tmp, "lyrics.db"))
+        texts = []
+        for rows in database.iter_lyrics():
+            texts += [row[2] for row in rows if row[2]]
+            if len(texts) >= args.limit:
+                break
+        texts = texts[: args.limit]
+
+        recommender = Recommender(database, tmp)
+        recommender.batchSize = args.batch_size
+        model = recommender.model
+        window = model.max_seq_length - 2
+        # warm up so neither timing includes loading weights or the first call's setup
+        model.encode(texts[:8], batch_size=8)
+
+        start = perf_counter()
+        raw = np.asarray(model.encode(texts, batch_size=args.batch_size), dtype=np.float32)
+        rawTime = perf_counter() - start
+
+        start = perf_counter()
+        cleaned = [lyricPreprocess.clean(text) for text in texts]
+        processed = recommender.embed(cleaned)
+        processedTime = perf_counter() - start
+        database.close()
+
+    rawTokens = lyricPreprocess.fit_window(model.tokenizer, texts, window)[1]
+    cleanedTokens = lyricPreprocess.fit_window(model.tokenizer, cleaned, window)[1]
+    fullTokens = np.array([len(ids) for ids in model.tokenizer(texts, add_special_tokens=False)["input_ids"]])
+    similarity = np.einsum(
+        "ij,ij->i",
+        raw / np.linalg.norm(raw, axis=1, keepdims=True),
+        processed / np.linalg.norm(processed, axis=1, keepdims=True),
+    )
+
+    print(f"{len(texts)} songs, token window {window}, {np.mean(fullTokens > window):.0%} of raw lyrics longer than it")
+    print(f"{'':>13} {'rows/s':>10} {'tokens/song':>12}")
+    print(f"{'raw':>13} {len(texts) / rawTime:>10.1f} {rawTokens.mean():>12.1f}")
+    print(f"{'preprocessed':>13} {len(texts) / processedTime:>10.1f} {cleanedTokens.mean():>12.1f}")
+    print(
+        f"drift: cosine similarity mean {similarity.mean():.4f}, 5th percentile {np.percentile(similarity, 5):.4f}, "
+        f"min {similarity.min():.4f}; 10 nearest neighbors kept {neighbor_overlap(raw, processed):.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
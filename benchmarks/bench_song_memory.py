@@ -0,0 +1,84 @@
+"""
+Memory and allocation time for 10k Song objects and linked list Nodes, comparing the slotted
+classes with the previous __dict__ based ones.
+
+uv run ./benchmarks/bench_song_memory.py [--count 10000]
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stubs import offline_app
+
+offline_app()
+from main import Song, database
+from SinglyLinkedList import Node
+
+
+class OldSong:
+    """Song as it was before __slots__, including its database back reference"""
+
+    def __init__(self, name, artists, id, album, duration_ms, database, lyrics=None):
+        self.name = name
+        self.artists = artists
+        self.id = id
+        self.album = album
+        self.duration_ms = duration_ms
+        self.lyrics = lyrics
+        self.database = database
+
+
+class OldNode:
+    def __init__(self, value=None, next=None):
+        self.next = None
+        self.value = value
+
+
+# shared by every song so only the per-object overhead is measured
+ARTISTS = [{"id": "artist", "name": "artist"}]
+
+
+def new_song(i: int) -> Song:
+    return Song(name="song", artists=ARTISTS, id="id", album="album", duration_ms=i)
+
+
+def old_song(i: int) -> OldSong:
+    return OldSong(name="song", artists=ARTISTS, id="id", album="album", duration_ms=i, database=database)
+
+
+def measure(make, count: int) -> tuple[float, float]:
+    """Return (bytes per object, microseconds per object)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = perf_counter()
+    objects = [make(i) for i in range(count)]
+    elapsed = perf_counter() - start
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count, elapsed / count * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{args.count} objects, tracemalloc on (times include its overhead)")
+    print(f"{'':<12} {'bytes/obj':>10} {'us/obj':>8} {'MB total':>9}")
+    for name, make in (
+        ("old Song", old_song),
+        ("Song", new_song),
+        ("old Node", lambda i: OldNode(i)),
+        ("Node", lambda i: Node(i)),
+    ):
+        size, us = measure(make, args.count)
+        print(f"{name:<12} {size:>10.1f} {us:>8.2f} {size * args.count / 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
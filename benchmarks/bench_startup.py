@@ -0,0 +1,70 @@
+"""
+Measure how long `import main` takes, the time to first byte of the static landing page and
+how long the background warm-up takes until /ready answers 200. Each run is a fresh
+interpreter in a temporary directory holding a copy of example.db as lyrics.db, so the
+first run also includes building the embeddings and index.
+
+uv run ./benchmarks/bench_startup.py [--runs 3]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# runs inside the child interpreter and prints its measurements as json
+PROBE = """
+import json, sys
+from time import perf_counter, sleep
+start = perf_counter()
+import main
+imported = perf_counter()
+client = main.app.test_client()
+assert client.get("/").status_code == 200
+first_byte = perf_counter()
+main.recommender.start_warm_up()
+while client.get("/ready").status_code != 200:
+    sleep(0.01)
+ready = perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_byte": first_byte - start,
+    "ready": ready - start,
+}))
+"""
+
+
+def run_once(cwd: str) -> dict[str, float]:
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("CLIENT_ID", "benchmark")
+    env.setdefault("CLIENT_SECRET", "benchmark")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=cwd, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(os.path.join(ROOT, "example.db"), os.path.join(tmp, "lyrics.db"))
+        print(f"{'run':>4} {'import':>10} {'first byte':>12} {'ready':>10}")
+        for run in range(args.runs):
+            times = run_once(tmp)
+            print(
+                f"{run + 1:>4} {times['import']:>9.3f}s {times['first_byte']:>11.3f}s {times['ready']:>9.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
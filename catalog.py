@@ -0,0 +1,74 @@
+"""
+Compact columnar item_id -> Spotify id mapping used to turn index results back into tracks.
+item_ids are an int64 array, Spotify ids a fixed-width bytes array (base62 ids are ASCII) and a
+direct address table gives the row of any item_id in O(1), so results are mapped with array
+indexing instead of DataFrame merges and no lyric text is kept around.
+"""
+
+from typing import Iterable
+
+import numpy as np
+
+from lyricDB import LyricDB
+
+
+class Catalog:
+    def __init__(self, item_ids: Iterable[int], spotify_ids: Iterable[str]) -> None:
+        self.item_ids = np.asarray(list(item_ids), dtype=np.int64)
+        spotify_ids = [id.encode() for id in spotify_ids]
+        self.spotify_ids = np.array(spotify_ids, dtype=f"S{max(map(len, spotify_ids), default=1)}")
+        # positions[item_id] is the row of item_id, -1 if it isn't in the catalog
+        size = int(self.item_ids.max()) + 1 if len(self.item_ids) else 0
+        self.positions = np.full(size, -1, dtype=np.int32 if len(self.item_ids) < 2**31 else np.int64)
+        self.positions[self.item_ids] = np.arange(len(self.item_ids))
+        # (rows in Spotify id order, Spotify ids in that order) to find item_ids by Spotify id.
+        # Built on first use and published as one tuple so concurrent callers never see half of it
+        self.__bySpotify: tuple[np.ndarray, np.ndarray] | None = None
+
+    @classmethod
+    def from_database(cls, database: LyricDB) -> "Catalog":
+        rows = database.get_ids()
+        return cls((row[0] for row in rows), (row[1] for row in rows))
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def rows(self, item_ids) -> np.ndarray:
+        """Row of each item_id, -1 for ids that aren't in the catalog"""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        inRange = (item_ids >= 0) & (item_ids < len(self.positions))
+        rows = np.full(item_ids.shape, -1, dtype=np.int64)
+        rows[inRange] = self.positions[item_ids[inRange]]
+        return rows
+
+    def contains(self, item_ids) -> np.ndarray:
+        """Boolean mask of which item_ids are in the catalog"""
+        return self.rows(item_ids) >= 0
+
+    def find(self, spotify_ids: Iterable[str]) -> np.ndarray:
+        """item_id of each Spotify id, -1 for ids that aren't in the catalog"""
+        encoded = [id.encode() for id in spotify_ids]
+        if len(self.item_ids) == 0 or len(encoded) == 0:
+            return np.full(len(encoded), -1, dtype=np.int64)
+        bySpotify = self.__bySpotify
+        if bySpotify is None:
+            order = np.argsort(self.spotify_ids, kind="stable")
+            bySpotify = self.__bySpotify = (order, self.spotify_ids[order])
+        order, sortedSpotify = bySpotify
+        # ids longer than the column would be truncated by the cast and could match a stored prefix
+        fits = np.array([len(id) <= self.spotify_ids.itemsize for id in encoded])
+        keys = np.array(encoded, dtype=self.spotify_ids.dtype)
+        found = np.searchsorted(sortedSpotify, keys).clip(max=len(self.item_ids) - 1)
+        rows = order[found]
+        return np.where(fits & (self.spotify_ids[rows] == keys), self.item_ids[rows], -1)
+
+    def spotify(self, item_ids) -> list[str]:
+        """Spotify ids for the given item_ids in order, skipping ids that aren't in the catalog"""
+        rows = self.rows(item_ids)
+        return [id.decode() for id in self.spotify_ids[rows[rows >= 0]]]
+
+
+if __name__ == "__main__":
+    catalog = Catalog([1, 2, 5], ["2OzhQlSqBEmt7hmkYxfT6m", "78RdTKcI2CediltTnGLIqr", "10pstCVmtxdb4TZ0pL4IjH"])
+    print(len(catalog), catalog.contains([1, 3, 5, 99]), catalog.spotify([5, 3, 1]))
+    print(catalog.find(["10pstCVmtxdb4TZ0pL4IjH", "missing", "2OzhQlSqBEmt7hmkYxfT6m"]))
@@ -0,0 +1,140 @@
+"""
+Parallel embedding for large initial index builds. The first Recommender over a big lyric table
+would otherwise encode every row in one process. This splits the rows the embedding matrix is
+missing into item_id ranges (shards) and encodes them in a pool of worker processes. Each worker
+loads the model once and writes its shard to <index-dir>/embedding-shards as its own embedding
+matrix. Once every shard is done they are merged into the embedding matrix in item_id order and
+the index is brought up to date from it. Shards left by an interrupted run are merged on the
+next run, so finished work isn't encoded again.
+
+uv run ./embed.py --db lyrics.db --workers 4 --threads 2
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from time import perf_counter
+
+import numpy as np
+
+from embeddingMatrix import EmbeddingMatrix
+from lyricDB import LyricDB
+from Recommender import Recommender
+
+type Shard = tuple[int, int, np.ndarray]
+
+# the Recommender of each worker process, set up once by init_worker
+worker: Recommender | None = None
+
+
+def init_worker(db: str, directory: str, batch_size: int, threads: int) -> None:
+    """Load the model once per worker process"""
+    global worker
+    import torch
+
+    # without a limit every worker starts one torch thread per core and they fight over them
+    torch.set_num_threads(threads)
+    worker = Recommender(LyricDB(db), directory)
+    worker.batchSize = batch_size
+    worker.model
+
+
+def embed_shard(number: int, after: int, item_ids: np.ndarray, shard_dir: str, chunk_size: int) -> tuple[int, int, float]:
+    """Encode the rows of item_ids (sorted, all greater than after) into shard-<number>, returns (number, rows, seconds)"""
+    start = perf_counter()
+    wanted = set(item_ids.tolist())
+    shard = EmbeddingMatrix(os.path.join(shard_dir, f"shard-{number}"), worker.dimensions, worker.embeddingID)
+    done = 0
+    for rows in worker.lyrics.iter_lyrics(chunk_size, after=after, until=int(item_ids[-1])):
+        rows = [row for row in rows if row[0] in wanted]
+        if len(rows) == 0:
+            continue
+        # written chunk by chunk so an interrupted shard keeps the rows it finished
+        shard.append([row[0] for row in rows], worker.encode([row[2] or "" for row in rows]))
+        done += len(rows)
+    return number, done, perf_counter() - start
+
+
+def make_shards(missing: list[int], shard_size: int) -> list[Shard]:
+    """Split sorted item_ids into (number, after, item_ids) ranges of shard_size rows"""
+    missing = np.asarray(sorted(missing), dtype=np.int64)
+    return [
+        (number, int(missing[start]) - 1, missing[start : start + shard_size])
+        for number, start in enumerate(range(0, len(missing), shard_size))
+    ]
+
+
+def merge_shards(recommender: Recommender, shard_dir: str) -> int:
+    """Append every shard in shard_dir to the embedding matrix in item_id order and delete it, returns rows added"""
+    paths = sorted(
+        (path.removesuffix(".json") for path in glob.glob(os.path.join(shard_dir, "shard-*.json"))),
+        key=lambda path: int(path.rsplit("-", 1)[1]),
+    )
+    matrix = recommender.matrix
+    added = 0
+    for path in paths:
+        shard = EmbeddingMatrix(path, recommender.dimensions, recommender.embeddingID)
+        # a shard merged just before a crash may be merged again, skip what the matrix already has
+        ids = matrix.missing(shard.ids.tolist())
+        if len(ids) > 0:
+            ids, vectors = shard.get(ids)
+            matrix.append(ids, vectors)
+            added += len(ids)
+        shard.remove()
+    return added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Embed the lyric table in parallel and update the index")
+    parser.add_argument("--db", default="lyrics.db")
+    parser.add_argument("--index-dir", default=".", help="directory of the index files and the embedding matrix")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="worker processes")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads per worker, default splits the cores between workers")
+    parser.add_argument("--batch-size", type=int, default=64, help="lyrics per forward pass")
+    parser.add_argument("--shard-size", type=int, default=10_000, help="rows per shard")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="rows read and written per step within a shard")
+    args = parser.parse_args()
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    database = LyricDB(args.db)
+    recommender = Recommender(database, args.index_dir)
+    shardDir = os.path.join(args.index_dir, "embedding-shards")
+    os.makedirs(shardDir, exist_ok=True)
+    resumed = merge_shards(recommender, shardDir)
+    if resumed > 0:
+        print(f"Merged {resumed} rows left by an earlier run")
+
+    missing = recommender.matrix.missing(row[0] for row in database.get_ids())
+    shards = make_shards(missing, args.shard_size)
+    print(f"Embedding {len(missing)} songs in {len(shards)} shards with {args.workers} workers x {threads} threads")
+
+    start = perf_counter()
+    if len(shards) > 0:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            # torch doesn't survive fork well, start each worker as a fresh interpreter
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(args.db, args.index_dir, args.batch_size, threads),
+        ) as pool:
+            futures = [pool.submit(embed_shard, *shard, shardDir, args.chunk_size) for shard in shards]
+            for future in as_completed(futures):
+                number, rows, seconds = future.result()
+                print(f"  shard {number}: {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):.1f} rows/s)")
+    encoded = perf_counter() - start
+    added = merge_shards(recommender, shardDir)
+    print(f"Embedded {added} songs in {encoded:.1f}s ({added / max(encoded, 1e-9):.1f} rows/s including worker start-up)")
+
+    start = perf_counter()
+    if len(recommender.matrix) > recommender.config.exact_limit:
+        recommender.load_index()
+        print(f"Index updated in {perf_counter() - start:.1f}s")
+    else:
+        print(f"{len(recommender.matrix)} songs are searched exactly, no index needed")
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
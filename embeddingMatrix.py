@@ -0,0 +1,179 @@
+"""
+On-disk embedding matrix so indexes can be rebuilt without holding every vector in RAM.
+Vectors are fixed-width little endian float32 rows in <path>.f32, the item_id of each row is
+the int64 at the same position in <path>.ids and <path>.json records the model and dimensions.
+Both files are opened read-only with numpy.memmap, so rows are paged in from disk as they are
+read and several worker processes share the same pages. Writers (the web app, ingest.py and
+embed.py) take an exclusive lock on <path>.lock, so appends from different processes don't
+overwrite each other.
+Ref: https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+FLOAT = np.dtype("<f4")
+ID = np.dtype("<i8")
+
+
+class EmbeddingMatrix:
+    def __init__(self, path: str = "./embeddings", dimensions: int = 384, model: str = "") -> None:
+        self.path = path
+        self.dimensions = dimensions
+        self.model = model
+        self.vectorPath = path + ".f32"
+        self.idPath = path + ".ids"
+        self.headerPath = path + ".json"
+        self.lockPath = path + ".lock"
+        self.__check_header()
+        self.__open()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: int) -> bool:
+        return len(self.positions([item_id])) > 0
+
+    @contextmanager
+    def __locked(self) -> Iterator[None]:
+        """Hold the exclusive write lock of the matrix files, shared with other processes"""
+        with open(self.lockPath, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __check_header(self) -> None:
+        """Start a new matrix if there is none yet or it was made by a different model"""
+        header = {"model": self.model, "dimensions": self.dimensions, "dtype": FLOAT.str}
+        with self.__locked():
+            if os.path.isfile(self.headerPath):
+                with open(self.headerPath) as f:
+                    if json.load(f) == header:
+                        return
+                print(f"Embedding matrix {self.path} was made by a different model, starting over")
+            for path in (self.vectorPath, self.idPath):
+                if os.path.isfile(path):
+                    os.remove(path)
+            with open(self.headerPath, "w") as f:
+                json.dump(header, f)
+
+    def __stored_rows(self) -> int:
+        """Whole rows present in both files. A crash mid append can leave a partial trailing row"""
+        rowBytes = self.dimensions * FLOAT.itemsize
+        vecRows = os.path.getsize(self.vectorPath) // rowBytes if os.path.isfile(self.vectorPath) else 0
+        idRows = os.path.getsize(self.idPath) // ID.itemsize if os.path.isfile(self.idPath) else 0
+        return min(vecRows, idRows)
+
+    def __open(self) -> None:
+        rows = self.__stored_rows()
+        # memmap can't map an empty file
+        if rows == 0:
+            vectors = np.empty((0, self.dimensions), dtype=FLOAT)
+            ids = np.empty(0, dtype=ID)
+        else:
+            vectors = np.memmap(self.vectorPath, dtype=FLOAT, mode="r", shape=(rows, self.dimensions))
+            ids = np.memmap(self.idPath, dtype=ID, mode="r", shape=(rows,))
+        # published as one tuple so a refresh() from the reload thread swaps both at once.
+        # Readers take it once per call and never mix old and new arrays
+        self.__mapped: tuple[np.ndarray, np.ndarray] = (ids, vectors)
+        # (ids, order, sorted ids) offset index, built the first time a lookup by item_id needs
+        # it and only used while its ids are still the mapped ones
+        self.__index: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.__mapped[0]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.__mapped[1]
+
+    def append(self, item_ids, vectors: np.ndarray) -> None:
+        """Add rows to the end of the matrix"""
+        item_ids = np.asarray(item_ids, dtype=ID)
+        vectors = np.asarray(vectors, dtype=FLOAT).reshape(len(item_ids), self.dimensions)
+        if len(item_ids) == 0:
+            return
+        with self.__locked():
+            # counted from the files, not len(self), which misses rows other processes appended
+            # since this one mapped them. Only a partial row left by a crash is dropped
+            rows = self.__stored_rows()
+            # another process may have stored some of these item_ids since this one mapped the
+            # files, check against the ids on disk so no item_id gets a second row
+            if rows > 0:
+                stored = np.isin(item_ids, np.memmap(self.idPath, dtype=ID, mode="r", shape=(rows,)))
+                item_ids, vectors = item_ids[~stored], vectors[~stored]
+            for path, size, data in (
+                (self.vectorPath, rows * self.dimensions * FLOAT.itemsize, vectors),
+                (self.idPath, rows * ID.itemsize, item_ids),
+            ):
+                with open(path, "ab") as f:
+                    if f.tell() != size:
+                        f.truncate(size)
+                    f.write(data.tobytes())
+        self.__open()
+
+    def remove(self) -> None:
+        """Delete the matrix files"""
+        with self.__locked():
+            for path in (self.vectorPath, self.idPath, self.headerPath):
+                if os.path.isfile(path):
+                    os.remove(path)
+        os.remove(self.lockPath)
+        self.__open()
+
+    def refresh(self) -> None:
+        """Map rows appended by other processes (e.g. ingest.py) since the matrix was opened"""
+        self.__open()
+
+    def __lookup(self, item_ids, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return (row positions in ids, mask of which item_ids are stored)"""
+        item_ids = np.asarray(item_ids, dtype=ID)
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.intp), np.zeros(len(item_ids), dtype=bool)
+        index = self.__index
+        if index is None or index[0] is not ids:
+            order = np.argsort(ids, kind="stable")
+            index = self.__index = (ids, order, np.asarray(ids[order]))
+        _, order, sortedIDs = index
+        found = np.searchsorted(sortedIDs, item_ids).clip(max=len(ids) - 1)
+        stored = sortedIDs[found] == item_ids
+        return order[found[stored]], stored
+
+    def positions(self, item_ids) -> np.ndarray:
+        """Row positions of the given item_ids, ids that aren't stored are skipped"""
+        return self.__lookup(item_ids, self.ids)[0]
+
+    def get(self, item_ids) -> tuple[np.ndarray, np.ndarray]:
+        """Return (item_ids, vectors) for the given ids that are stored, in the order given"""
+        ids, vectors = self.__mapped
+        rows = self.__lookup(item_ids, ids)[0]
+        return np.asarray(ids[rows]), np.asarray(vectors[rows])
+
+    def missing(self, item_ids) -> list[int]:
+        """The given item_ids that have no row yet"""
+        item_ids = list(item_ids)
+        stored = self.__lookup(item_ids, self.ids)[1]
+        return [item_id for item_id, isStored in zip(item_ids, stored) if not isStored]
+
+    def iter_chunks(self, chunk_size: int = 4096) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield (item_ids, vectors) views chunk_size rows at a time without loading the whole file"""
+        ids, vectors = self.__mapped
+        for start in range(0, len(ids), chunk_size):
+            yield ids[start : start + chunk_size], vectors[start : start + chunk_size]
+
+
+if __name__ == "__main__":
+    matrix = EmbeddingMatrix("./example_embeddings", dimensions=4, model="example")
+    matrix.append([3, 1, 2], np.arange(12).reshape(3, 4))
+    print(len(matrix), 2 in matrix, 7 in matrix)
+    print(matrix.get([2, 7, 3]))
+    for ids, vectors in matrix.iter_chunks(2):
+        print(ids, vectors)
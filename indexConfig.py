@@ -0,0 +1,73 @@
+"""
+Tuning knobs for the Voyager (HNSW) index.
+  space: distance used by the index. MiniLM embeddings are compared by angle, so Cosine
+  M: links per node in the graph, more is better recall for more memory and slower builds
+  ef_construction: candidates considered while inserting, more is better graph quality for slower builds
+  query_ef: candidates considered per query, more is better recall for slower queries (-1 uses the index default)
+  storage: Float32, or Float8 / E4M3 to store each dimension in one byte for a quarter of the memory
+  exact_limit: catalogs up to this many songs skip the index and are searched exactly (see searchBackend.py)
+Every setting can be overridden by an INDEX_<NAME> environment variable (or .env entry), so
+the web app and ingest.py build and load the same index.
+Ref: https://spotify.github.io/voyager/python/reference.html
+"""
+
+import os
+from typing import Any, NamedTuple
+
+from dotenv import load_dotenv
+from voyager import Index, Space, StorageDataType
+
+
+class IndexConfig(NamedTuple):
+    space: Space = Space.Cosine
+    M: int = 12
+    ef_construction: int = 200
+    query_ef: int = -1
+    storage: StorageDataType = StorageDataType.Float32
+    exact_limit: int = 10_000
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        load_dotenv()
+        default = cls()
+        return cls(
+            space=Space.__members__[os.getenv("INDEX_SPACE", default.space.name)],
+            M=int(os.getenv("INDEX_M", default.M)),
+            ef_construction=int(os.getenv("INDEX_EF_CONSTRUCTION", default.ef_construction)),
+            query_ef=int(os.getenv("INDEX_QUERY_EF", default.query_ef)),
+            storage=StorageDataType.__members__[os.getenv("INDEX_STORAGE", default.storage.name)],
+            exact_limit=int(os.getenv("INDEX_EXACT_LIMIT", default.exact_limit)),
+        )
+
+    def build(self, dimensions: int, max_elements: int = 1) -> Index:
+        """A new empty index with these settings"""
+        return Index(
+            self.space,
+            num_dimensions=dimensions,
+            M=self.M,
+            ef_construction=self.ef_construction,
+            max_elements=max_elements,
+            storage_data_type=self.storage,
+        )
+
+    def params(self) -> dict[str, Any]:
+        """The settings baked into a built index, recorded in its manifest. query_ef and exact_limit aren't"""
+        return {
+            "space": self.space.name,
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "storage": self.storage.name,
+        }
+
+    def ef(self, k: int) -> int:
+        """query_ef for a k nearest neighbor query, voyager refuses a query_ef below k"""
+        return max(self.query_ef, k) if self.query_ef > 0 else -1
+
+    def __str__(self) -> str:
+        return f"{self.space.name} M={self.M} ef_construction={self.ef_construction} query_ef={self.query_ef} {self.storage.name}"
+
+
+if __name__ == "__main__":
+    config = IndexConfig.from_env()
+    print(config, config.params())
+    print(config._replace(storage=StorageDataType.E4M3).build(384))
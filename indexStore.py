@@ -0,0 +1,109 @@
+"""
+Versioned storage for Voyager indexes. Each save writes a new index-<version>.voy next to a
+manifest (index-manifest.json) describing the current version: model, dimensions, row count,
+largest item_id and a sha256 checksum of the file. Both are written to a temporary file, synced
+and renamed into place, so readers only ever see a complete index and a manifest that matches
+it. Saves hold an exclusive lock on index-manifest.lock, so two processes saving at once (e.g.
+ingest.py and the web app) get different versions. Processes serving requests poll the manifest
+to notice indexes saved by other processes.
+"""
+
+import fcntl
+import json
+import os
+from hashlib import sha256
+from time import time
+from typing import Any
+
+from voyager import Index
+
+type Manifest = dict[str, Any]
+
+
+def file_checksum(path: str) -> str:
+    digest = sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, write) -> None:
+    """Call write(tmpPath), sync the file to disk then rename it over path"""
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmpPath)
+        with open(tmpPath, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+class IndexStore:
+    def __init__(self, directory: str = ".", keep: int = 2) -> None:
+        self.directory = directory
+        # versions kept on disk so a process still loading the previous one can finish
+        self.keep = keep
+        self.manifestPath = os.path.join(directory, "index-manifest.json")
+        self.lockPath = os.path.join(directory, "index-manifest.lock")
+
+    def path(self, version: int) -> str:
+        return os.path.join(self.directory, f"index-{version}.voy")
+
+    def current(self) -> Manifest | None:
+        """The manifest of the current index, None if nothing has been saved yet"""
+        if not os.path.isfile(self.manifestPath):
+            return None
+        with open(self.manifestPath) as f:
+            return json.load(f)
+
+    def save(self, index: Index, **meta) -> Manifest:
+        """Save index as the next version and make it current. meta is added to the manifest"""
+        # the version is read and the manifest written under one lock, otherwise an overlapping
+        # save picks the same version and overwrites the file this one's checksum describes
+        with open(self.lockPath, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self.__save(index, meta)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def __save(self, index: Index, meta: dict) -> Manifest:
+        current = self.current()
+        version = current["version"] + 1 if current else 1
+        path = self.path(version)
+        write_atomic(path, index.save)
+        ids = list(index.ids)
+        manifest = {
+            "version": version,
+            "file": os.path.basename(path),
+            "sha256": file_checksum(path),
+            "dimensions": index.num_dimensions,
+            "rows": len(index),
+            "max_item_id": max(ids) if ids else 0,
+            "created": time(),
+            **meta,
+        }
+
+        def write_manifest(tmpPath):
+            with open(tmpPath, "w") as f:
+                json.dump(manifest, f, indent=1)
+
+        write_atomic(self.manifestPath, write_manifest)
+        self.__remove_old(version)
+        return manifest
+
+    def load(self, manifest: Manifest) -> Index:
+        """Load the index a manifest describes, raises ValueError if the file doesn't match its checksum"""
+        path = os.path.join(self.directory, manifest["file"])
+        if file_checksum(path) != manifest["sha256"]:
+            raise ValueError(f"Index file {path} does not match its checksum")
+        return Index.load(path)
+
+    def __remove_old(self, version: int) -> None:
+        for old in range(version - self.keep, 0, -1):
+            if not os.path.isfile(self.path(old)):
+                break
+            os.remove(self.path(old))
@@ -0,0 +1,245 @@
+"""
+Offline ingestion job for the candidate catalog. Crawls Spotify new releases, albums and
+playlists, resolves their lyrics through LRCLIB, stores the track metadata in the tracks table
+beside the lyrics and updates the embeddings and Voyager index incrementally. The web app then
+only has to query this prebuilt catalog instead of crawling inside a user's request.
+
+Run it daily with e.g. `uv run ./ingest.py --new-releases 50`.
+`--record DIR` saves every Spotify and LRCLIB response while running live and `--fixtures DIR`
+replays them, so the whole job can run offline against the recorded fixtures in this repo:
+`uv run ./ingest.py --fixtures fixtures --new-releases 2 --playlist 37i9dQZF1DXcBWIGoYBM5M --db fixture.db --skip-index`
+"""
+
+import argparse
+import json
+import os
+import re
+from itertools import islice
+from typing import Any, Iterator
+
+from dotenv import load_dotenv
+
+from lyricDB import LyricDB
+from lyricFetcher import LyricFetcher
+from pagination import iter_items
+
+type Track = dict[str, Any]
+# (kind, id, name, tracks) of a crawled album or playlist
+type Source = tuple[str, str, str, list[Track]]
+
+
+def fixture_name(method: str, args: tuple, kwargs: dict) -> str:
+    """File name a Spotify call is recorded under, e.g. album-<id>.json"""
+    parts = [method, *(str(arg) for arg in args), *(f"{k}={v}" for k, v in sorted(kwargs.items()))]
+    return re.sub(r"[^\w=.-]", "_", "-".join(parts)) + ".json"
+
+
+class RecordedSpotify:
+    """Replays Spotify responses saved by RecordingSpotify instead of calling the API"""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.join(directory, "spotify")
+
+    def __getattr__(self, method: str):
+        def replay(*args, **kwargs):
+            path = os.path.join(self.directory, fixture_name(method, args, kwargs))
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No recorded Spotify response {path}")
+            with open(path) as f:
+                return json.load(f)
+
+        return replay
+
+
+class RecordingSpotify:
+    """Passes calls through to a spotipy client and saves each response for RecordedSpotify"""
+
+    def __init__(self, sp, directory: str) -> None:
+        self.sp = sp
+        self.directory = os.path.join(directory, "spotify")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getattr__(self, method: str):
+        def record(*args, **kwargs):
+            response = getattr(self.sp, method)(*args, **kwargs)
+            with open(os.path.join(self.directory, fixture_name(method, args, kwargs)), "w") as f:
+                json.dump(response, f, indent=1)
+            return response
+
+        return record
+
+
+class RecordedLyricFetcher(LyricFetcher):
+    """
+    LyricFetcher that answers from DIR/lrclib.json ({spotify id: lyrics or ""}) when replaying,
+    or fills that file from the live API when recording.
+    """
+
+    def __init__(self, database: LyricDB, directory: str, record: bool = False, **kwargs) -> None:
+        super().__init__(database, **kwargs)
+        self.path = os.path.join(directory, "lrclib.json")
+        self.record = record
+        self.recorded: dict[str, str] = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.recorded = json.load(f)
+
+    def fetch(self, song) -> str | None:
+        if not self.record:
+            return self.recorded.get(song["id"])
+        lyrics = super().fetch(song)
+        if lyrics is not None:
+            self.recorded[song["id"]] = lyrics
+        return lyrics
+
+    def close(self) -> None:
+        super().close()
+        if self.record:
+            with open(self.path, "w") as f:
+                json.dump(self.recorded, f, indent=1)
+
+
+def track_from(songDict: dict, album: str) -> Track:
+    return {
+        "id": songDict["id"],
+        # blank names break the LRCLIB lookup
+        "name": songDict["name"] or "blank",
+        "artists": [{"id": a.get("id"), "name": a["name"]} for a in songDict["artists"]],
+        "album": album,
+        "duration_ms": songDict["duration_ms"],
+        "lyrics": None,
+    }
+
+
+def new_release_ids(sp, n: int) -> list[tuple[str, str]]:
+    """(album id, album name) for n new releases"""
+
+    def fetch_page(offset, limit):
+        page = sp.new_releases(limit=limit, offset=offset, country="US")["albums"]
+        # only request the pages holding the first n releases
+        return {**page, "total": min(page.get("total", n), n)}
+
+    albums = iter_items(fetch_page, limit=min(50, n))
+    return [(album["id"], album["name"]) for album in islice(albums, n)]
+
+
+def album_tracks(sp, al_id: str) -> tuple[str, list[Track]]:
+    album = sp.album(al_id)
+    return album["name"], [track_from(song, album["name"]) for song in album["tracks"]["items"]]
+
+
+def playlist_tracks(sp, pl_id: str) -> tuple[str, list[Track]]:
+    name = sp.playlist(pl_id, fields="name")["name"]
+
+    def fetch_page(offset, limit):
+        return sp.playlist_tracks(
+            pl_id,
+            fields="items(track(id, name, artists, album(name), duration_ms)),total",
+            offset=offset,
+            limit=limit,
+        )
+
+    # local files and removed tracks come back without a track or id
+    tracks = [
+        track_from(item["track"], item["track"]["album"]["name"])
+        for item in iter_items(fetch_page, limit=100)
+        if item.get("track") and item["track"].get("id")
+    ]
+    return name, tracks
+
+
+def crawl(sp, database: LyricDB, albums: list[str], playlists: list[str], refresh: bool) -> Iterator[Source]:
+    """Yield (kind, id, name, tracks) of each album and playlist that hasn't been ingested yet"""
+    sources = [("album", id, album_tracks) for id in albums] + [
+        ("playlist", id, playlist_tracks) for id in playlists
+    ]
+    for kind, id, get_tracks in sources:
+        if not refresh and database.is_ingested(id):
+            continue
+        name, tracks = get_tracks(sp, id)
+        print(f"Crawled {kind} ({name}): {len(tracks)} tracks")
+        yield kind, id, name, tracks
+
+
+def ingest(sp, database: LyricDB, fetcher: LyricFetcher, albums: list[str], playlists: list[str], refresh: bool = False) -> tuple[int, int]:
+    """
+    Store metadata and lyrics for every crawled track, returns (tracks seen, tracks unresolved).
+    A source is only marked ingested once every track's lyrics resolved, so tracks whose fetch
+    failed (network error, 5xx) are tried again on the next run.
+    """
+    seen = 0
+    unresolved = 0
+    for kind, id, name, tracks in crawl(sp, database, albums, playlists, refresh):
+        database.insert_tracks_many(tracks)
+        unknownIDs = set(database.lookup_many(track["id"] for track in tracks).unknown)
+        unknown = [track for track in tracks if track["id"] in unknownIDs]
+        found = fetcher.fetch_many(unknown)
+        # songs LRCLIB can't be asked about won't resolve on a later run either
+        failed = [track for track in unknown if track["id"] not in found and fetcher.searchable(track)]
+        print(f"  {len(tracks) - len(unknown)} lyrics cached, {len(found)}/{len(unknown)} fetched")
+        if len(failed) > 0:
+            print(f"  {len(failed)} lookups failed, ({name}) will be crawled again next run")
+        else:
+            database.mark_ingested(id, kind, name)
+        seen += len(tracks)
+        unresolved += len(failed)
+    return seen, unresolved
+
+
+def get_spotify():
+    from spotipy import Spotify
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    # the job has no user, client credentials can read new releases, albums and public playlists
+    load_dotenv()
+    return Spotify(
+        auth_manager=SpotifyClientCredentials(
+            client_id=os.getenv("CLIENT_ID"), client_secret=os.getenv("CLIENT_SECRET")
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the candidate catalog offline")
+    parser.add_argument("--new-releases", type=int, default=0, help="number of new release albums to crawl")
+    parser.add_argument("--album", action="append", default=[], help="album id to crawl, repeatable")
+    parser.add_argument("--playlist", action="append", default=[], help="playlist id to crawl, repeatable")
+    parser.add_argument("--refresh", action="store_true", help="crawl albums and playlists again even if already ingested")
+    parser.add_argument("--db", default="lyrics.db")
+    parser.add_argument("--index-dir", default=".", help="directory of the index files and the embedding matrix")
+    parser.add_argument("--skip-index", action="store_true", help="don't update the embeddings and index")
+    replay = parser.add_mutually_exclusive_group()
+    replay.add_argument("--fixtures", metavar="DIR", help="replay recorded Spotify and LRCLIB responses from DIR")
+    replay.add_argument("--record", metavar="DIR", help="record Spotify and LRCLIB responses into DIR")
+    args = parser.parse_args()
+
+    database = LyricDB(args.db)
+    if args.fixtures:
+        sp = RecordedSpotify(args.fixtures)
+        fetcher = RecordedLyricFetcher(database, args.fixtures)
+    elif args.record:
+        sp = RecordingSpotify(get_spotify(), args.record)
+        fetcher = RecordedLyricFetcher(database, args.record, record=True)
+    else:
+        sp = get_spotify()
+        fetcher = LyricFetcher(database)
+
+    albums = [id for id, _ in new_release_ids(sp, args.new_releases)] if args.new_releases > 0 else []
+    albums += args.album
+    try:
+        seen, unresolved = ingest(sp, database, fetcher, albums, args.playlist, args.refresh)
+    finally:
+        fetcher.close()
+    print(f"Ingested {seen} tracks, {unresolved} without resolved lyrics")
+
+    if not args.skip_index:
+        # imported here so --skip-index runs don't load the model
+        from Recommender import Recommender
+
+        Recommender(database, args.index_dir).warm_up()
+        print("Index updated")
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
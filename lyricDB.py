@@ -6,57 +6,219 @@ will not have to wait forever in between API responses.
 Ref: https://docs.python.org/3/library/sqlite3.html
 """
 
+import json
+import re
 import sqlite3
-from typing import Iterable, Any
-from pandas import read_sql, DataFrame
+import threading
+from time import time
+from typing import TYPE_CHECKING, Iterable, Iterator, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 type Row = tuple[str, str]
 type Lyrics = list[Row]
 type Song = Any
 
-# BUG: this shit keeps closing improperly or something else happens and so the data is not accessible. need to prevent this
+
+class LyricLookup(NamedTuple):
+    """Result of LyricDB.lookup_many split by what the cache knows about each ID"""
+
+    hits: dict[str, str]
+    # stored with the "" sentinel, LRCLIB has no lyrics for these
+    misses: set[str]
+    # never looked up, these still need to go to LRCLIB
+    unknown: list[str]
+
+
+class ConnectionPool:
+    """
+    Hands out one sqlite3 connection per thread and keeps it open for the life of that thread
+    instead of connecting and closing on every call. Connections of threads that have exited
+    (e.g. finished Flask request threads) are closed the next time the pool is used.
+    """
+
+    # WAL lets readers keep going while another thread writes, NORMAL sync is safe under WAL
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA mmap_size=67108864",
+        "PRAGMA busy_timeout=5000",
+    )
+
+    def __init__(self, dbName: str) -> None:
+        self.dbName = dbName
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__connections: dict[threading.Thread, sqlite3.Connection] = {}
+
+    def __len__(self) -> int:
+        return len(self.__connections)
+
+    def get(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use"""
+        connection = getattr(self.__local, "connection", None)
+        if connection is not None:
+            return connection
+        # check_same_thread is off only so close_all() can close other threads' connections,
+        # each connection is still only used by the thread that opened it
+        connection = sqlite3.connect(self.dbName, timeout=5.0, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            connection.execute(pragma)
+        with self.__lock:
+            self.__prune()
+            self.__connections[threading.current_thread()] = connection
+        self.__local.connection = connection
+        return connection
+
+    def release(self) -> None:
+        """Close the calling thread's connection"""
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            return
+        self.__local.connection = None
+        with self.__lock:
+            self.__connections.pop(threading.current_thread(), None)
+        connection.close()
+
+    def close_all(self) -> None:
+        with self.__lock:
+            connections = list(self.__connections.values())
+            self.__connections.clear()
+        for connection in connections:
+            connection.close()
+        self.__local = threading.local()
+
+    def __prune(self) -> None:
+        """Close connections left behind by dead threads. Caller must hold the lock"""
+        for thread in [t for t in self.__connections if not t.is_alive()]:
+            self.__connections.pop(thread).close()
+
 
 class LyricDB:
+    # schema changes, applied in order when a database is opened. PRAGMA user_version records
+    # how many have been applied, so append new ones to the end and never edit old ones
+    MIGRATIONS: tuple[tuple[str, ...], ...] = (
+        # 1: make id unique so lookups by Spotify ID use an index and INSERT or IGNORE / REPLACE
+        # really dedupe. Duplicates are dropped first, keeping the oldest row with lyrics (or
+        # the oldest row if none have any) so surviving item_ids still match the index
+        (
+            """DELETE FROM lyrics WHERE id IS NOT NULL AND item_id NOT IN (
+                SELECT COALESCE(MIN(CASE WHEN plainLyrics <> '' THEN item_id END), MIN(item_id))
+                FROM lyrics WHERE id IS NOT NULL GROUP BY id
+            )""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS lyrics_id ON lyrics(id)",
+        ),
+        # 2: full-text index of the lyrics for keyword search. It is an external content table,
+        # so the text is only stored once in lyrics, and triggers keep it in sync with lyrics.
+        # The rows already in lyrics are indexed by the rebuild
+        (
+            """CREATE VIRTUAL TABLE IF NOT EXISTS lyrics_fts USING fts5(
+                plainLyrics, content='lyrics', content_rowid='item_id', tokenize='unicode61 remove_diacritics 2'
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS lyrics_fts_insert AFTER INSERT ON lyrics BEGIN
+                INSERT INTO lyrics_fts(rowid, plainLyrics) VALUES (new.item_id, new.plainLyrics);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS lyrics_fts_delete AFTER DELETE ON lyrics BEGIN
+                INSERT INTO lyrics_fts(lyrics_fts, rowid, plainLyrics) VALUES ('delete', old.item_id, old.plainLyrics);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS lyrics_fts_update AFTER UPDATE ON lyrics BEGIN
+                INSERT INTO lyrics_fts(lyrics_fts, rowid, plainLyrics) VALUES ('delete', old.item_id, old.plainLyrics);
+                INSERT INTO lyrics_fts(rowid, plainLyrics) VALUES (new.item_id, new.plainLyrics);
+            END""",
+            "INSERT INTO lyrics_fts(lyrics_fts) VALUES ('rebuild')",
+        ),
+        # 3: taste profile of each playlist, the float64 mean of its songs' vectors made by model.
+        # members is the json list of Spotify IDs in it, snapshot_id the playlist version it matches
+        (
+            """CREATE TABLE IF NOT EXISTS taste_profiles(
+                key TEXT PRIMARY KEY, model TEXT, snapshot_id TEXT, centroid BLOB, count INTEGER, members TEXT, updated REAL
+            )""",
+        ),
+        # 4: the tables that were created outside of migrations before they existed, so the
+        # schema version covers every table but lyrics. IF NOT EXISTS keeps databases that have them
+        (
+            # float32 vector BLOBs keyed by a hash of the text they embed and the model that made them
+            "CREATE TABLE IF NOT EXISTS embeddings(hash TEXT, model TEXT, vector BLOB, PRIMARY KEY (hash, model)) WITHOUT ROWID",
+            # track metadata by Spotify ID, filled by the offline ingestion job and whenever the app
+            # already has it from a playlist or album. artists is the Spotify artist list as json
+            "CREATE TABLE IF NOT EXISTS tracks(id TEXT PRIMARY KEY, name TEXT, artists TEXT, album TEXT, duration_ms INTEGER, updated_at REAL)",
+            # recommendation results shared across processes and restarts, ids is a json list of Spotify IDs
+            "CREATE TABLE IF NOT EXISTS results(key TEXT PRIMARY KEY, ids TEXT, created REAL)",
+            # albums and playlists already crawled, so reruns only fetch what is new
+            "CREATE TABLE IF NOT EXISTS sources(id TEXT PRIMARY KEY, kind TEXT, name TEXT, ingested_at REAL)",
+        ),
+    )
+
     def __init__(self, dbName: str = "lyrics.db") -> None:
         if dbName[-3:] != ".db":
             dbName += ".db"
         self.dbName = dbName
-        self.connect()
-        # use cursor to send commands to the sql db
-        self.cursor = self.get_cursor()
+        # connections are opened lazily per thread so one LyricDB can be shared by Flask workers
+        self.pool = ConnectionPool(dbName)
         self.__create_table()
+        self.__migrate()
+
+    def __enter__(self) -> "LyricDB":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
     def close(self) -> None:
-        self.connection.close()
+        """Close every pooled connection. The pool reopens them on next use"""
+        self.pool.close_all()
 
     def connect(self) -> sqlite3.Connection:
-        self.connection = sqlite3.connect(self.dbName)
-        return self.connection
+        """Get the calling thread's pooled connection. Do not close it"""
+        return self.pool.get()
 
     def get_cursor(self) -> sqlite3.Cursor:
-        self.cursor = self.connect().cursor()
-        return self.cursor
-
-    def execute(self, query: str, params: tuple[str, str] | None = None) -> None:
-        if params is not None:
-            with self.connect():
-                self.cursor = self.connection.execute(query, params)
-            self.close()
-            return
-        with self.connect():
-            self.cursor = self.connection.execute(query)
-        self.close()
+        return self.connect().cursor()
+
+    def execute(self, query: str, params: tuple | None = None) -> None:
+        # using the connection as a context manager commits, or rolls back on error
+        with self.connect() as connection:
+            if params is not None:
+                connection.execute(query, params)
+                return
+            connection.execute(query)
 
     def executemany(self, query: str, data: Iterable) -> None:
-        with self.connect():
-            self.cursor = self.get_cursor().executemany(query, data)
-        self.close()
+        with self.connect() as connection:
+            connection.executemany(query, data)
 
     def __create_table(self) -> None:
+        # every other table comes from MIGRATIONS
         self.execute(
             "CREATE TABLE IF NOT EXISTS lyrics(item_id INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, plainLyrics TEXT)"
         )
 
+    @property
+    def schema_version(self) -> int:
+        """Number of MIGRATIONS applied to this database"""
+        return self.connect().execute("PRAGMA user_version").fetchone()[0]
+
+    def __migrate(self) -> None:
+        """Apply the migrations this database doesn't have yet, each in its own transaction"""
+        connection = self.connect()
+        for version, statements in enumerate(self.MIGRATIONS, start=1):
+            if self.schema_version >= version:
+                continue
+            # take the write lock before checking again, another process may be migrating too
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.schema_version < version:
+                    for statement in statements:
+                        connection.execute(statement)
+                    connection.execute(f"PRAGMA user_version = {version}")
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+
     def insert_many(self, query: str, data: list[tuple[str, str]]) -> None:
         self.executemany(query, data)
 
@@ -65,8 +227,12 @@ class LyricDB:
         self.execute("INSERT or IGNORE INTO lyrics(id, plainLyrics) VALUES (?, ?)", (id, lyrics))
 
     def replace_lyric(self, id: str, lyrics: str) -> None:
-        # check if song id already exists. if so, overwrite
-        self.execute("INSERT or REPLACE INTO lyrics(id, plainLyrics) VALUES (?, ?)", (id, lyrics))
+        # check if song id already exists. if so, overwrite. The row gets a new item_id so the
+        # new lyrics are embedded again instead of keeping the old row's vector.
+        # An explicit delete rather than INSERT or REPLACE, which doesn't fire delete triggers
+        with self.connect() as connection:
+            connection.execute("DELETE FROM lyrics WHERE id = ?", (id,))
+            connection.execute("INSERT INTO lyrics(id, plainLyrics) VALUES (?, ?)", (id, lyrics))
 
     def insert_lyric_many(self, songs: list[dict[Any, Any]]) -> None:
         data = [(song["id"], song["plainLyrics"]) for song in songs]
@@ -74,54 +240,236 @@ class LyricDB:
 
     def get_lyric_latest(self) -> Row:
         """Get the most recent row in the db"""
-        with self.connect():
-            res = self.connection.cursor().execute('SELECT id, plainLyrics FROM lyrics').fetchone()
-        self.close()
-        return res
+        return self.connect().execute("SELECT id, plainLyrics FROM lyrics").fetchone()
 
     def get_lyric_all(self) -> Lyrics:
-        # self.connect().row_factory = sqlite3.Row
-        with self.connect():
-            rows = (
-                self.connection.cursor()
-                .execute("SELECT id, plainLyrics from lyrics")
-                .fetchall()
-            )
-        self.close()
-        return rows
+        return self.connect().execute("SELECT id, plainLyrics from lyrics").fetchall()
 
     def get_all(self) -> list[tuple[str, str, int]]:
-        # self.connect().row_factory = sqlite3.Row
-        with self.connect():
-            rows = (
-                self.connection.cursor()
-                .execute("SELECT id, plainLyrics, item_id from lyrics")
-                .fetchall()
+        return (
+            self.connect()
+            .execute("SELECT id, plainLyrics, item_id from lyrics")
+            .fetchall()
+        )
+
+    def insert_tracks_many(self, tracks: Iterable[dict[str, Any]]) -> None:
+        """Insert or refresh track metadata. Each track needs id, name, artists, album and duration_ms"""
+        now = time()
+        self.executemany(
+            """INSERT INTO tracks(id, name, artists, album, duration_ms, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET name=excluded.name, artists=excluded.artists,
+            album=excluded.album, duration_ms=excluded.duration_ms, updated_at=excluded.updated_at""",
+            (
+                (
+                    track["id"],
+                    track["name"],
+                    # only keep what the app uses from Spotify's artist objects
+                    json.dumps([{"id": a.get("id"), "name": a["name"]} for a in track["artists"]]),
+                    track["album"],
+                    track["duration_ms"],
+                    now,
+                )
+                for track in tracks
+            ),
+        )
+
+    def get_tracks(self, ids: Iterable[str], chunk: int = 500) -> dict[str, dict[str, Any]]:
+        """Get stored track metadata by Spotify ID, updated_at is the unix time it was stored"""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        connection = self.connect()
+        for start in range(0, len(ids), chunk):
+            batch = ids[start : start + chunk]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT id, name, artists, album, duration_ms, updated_at FROM tracks WHERE id IN ({placeholders})",
+                batch,
             )
-        self.close()
-        return rows
+            for id, name, artists, album, duration_ms, updated_at in rows:
+                found[id] = {
+                    "id": id,
+                    "name": name,
+                    "artists": json.loads(artists),
+                    "album": album,
+                    "duration_ms": duration_ms,
+                    "updated_at": updated_at,
+                }
+        return found
+
+    def is_ingested(self, id: str) -> bool:
+        return self.connect().execute("SELECT 1 FROM sources WHERE id = ?", (id,)).fetchone() is not None
+
+    def mark_ingested(self, id: str, kind: str, name: str) -> None:
+        self.execute(
+            "INSERT or REPLACE INTO sources(id, kind, name, ingested_at) VALUES (?, ?, ?, ?)",
+            (id, kind, name, time()),
+        )
+
+    def get_result(self, key: str, max_age: float) -> list[str] | None:
+        """Get a stored recommendation result if it is younger than max_age seconds"""
+        row = (
+            self.connect()
+            .execute("SELECT ids FROM results WHERE key = ? AND created > ?", (key, time() - max_age))
+            .fetchone()
+        )
+        if row is not None:
+            return json.loads(row[0])
+
+    def put_result(self, key: str, ids: list[str]) -> None:
+        self.execute(
+            "INSERT or REPLACE INTO results(key, ids, created) VALUES (?, ?, ?)",
+            (key, json.dumps(ids), time()),
+        )
+
+    def remove_results(self, max_age: float) -> None:
+        """Delete stored recommendation results older than max_age seconds"""
+        self.execute("DELETE FROM results WHERE created <= ?", (time() - max_age,))
+
+    def get_profile(self, key: str) -> tuple[str, str | None, bytes, int, list[str]] | None:
+        """(model, snapshot_id, centroid, count, members) of a stored taste profile"""
+        row = (
+            self.connect()
+            .execute("SELECT model, snapshot_id, centroid, count, members FROM taste_profiles WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is not None:
+            return *row[:4], json.loads(row[4])
+
+    def put_profile(self, key: str, model: str, snapshot_id: str | None, centroid: bytes, count: int, members: list[str]) -> None:
+        self.execute(
+            "INSERT or REPLACE INTO taste_profiles(key, model, snapshot_id, centroid, count, members, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, snapshot_id, centroid, count, json.dumps(members), time()),
+        )
+
+    def iter_lyrics(
+        self, chunk_size: int = 1000, after: int = 0, until: int | None = None
+    ) -> Iterator[list[tuple[int, str, str]]]:
+        """
+        Yield (item_id, id, plainLyrics) rows with after < item_id <= until (no upper bound if
+        until is None) in item_id order, chunk_size rows at a time.
+        Uses keyset pagination on the primary key so each chunk is an index range scan and the
+        whole table is never loaded at once.
+        """
+        connection = self.connect()
+        until = until if until is not None else 2**63 - 1
+        while True:
+            rows = connection.execute(
+                "SELECT item_id, id, plainLyrics FROM lyrics WHERE item_id > ? AND item_id <= ? ORDER BY item_id LIMIT ?",
+                (after, until, chunk_size),
+            ).fetchall()
+            if len(rows) == 0:
+                return
+            yield rows
+            after = rows[-1][0]
+
+    def get_ids(self) -> list[tuple[int, str]]:
+        """(item_id, id) for every row with a Spotify ID, without the lyric text"""
+        # the original schema allowed NULL ids, those rows can't be mapped back to a track
+        return self.connect().execute("SELECT item_id, id FROM lyrics WHERE id IS NOT NULL ORDER BY item_id").fetchall()
 
     def search_lyric(self, song: Song) -> str | None:
-        with self.connect():
-            self.cursor = self.connection.execute(
-                'SELECT * FROM lyrics WHERE "id" = (?)', [song["id"]]
+        response = (
+            self.connect()
+            .execute('SELECT plainLyrics FROM lyrics WHERE "id" = (?)', [song["id"]])
+            .fetchone()
+        )
+        if response is not None:
+            return response[0]
+
+    def lookup_many(self, ids: Iterable[str], chunk: int = 500) -> LyricLookup:
+        """
+        Resolve a whole set of Spotify IDs against the cache with one IN (...) query per
+        chunk instead of one query per song. Unknown IDs keep their input order.
+        """
+        ids = list(dict.fromkeys(ids))
+        hits: dict[str, str] = {}
+        misses: set[str] = set()
+        connection = self.connect()
+        for start in range(0, len(ids), chunk):
+            batch = ids[start : start + chunk]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT id, plainLyrics FROM lyrics WHERE id IN ({placeholders})", batch
             )
-            response = self.cursor.fetchall()
-        if len(response) > 0:
-            return response[0][1]
+            for id, lyrics in rows:
+                if lyrics:
+                    hits[id] = lyrics
+                else:
+                    misses.add(id)
+        unknown = [id for id in ids if id not in hits and id not in misses]
+        return LyricLookup(hits, misses, unknown)
 
-    def remove_lyric(self, id: str) -> None:
-        with self.connect():
-            self.cursor = self.connection.execute(
-                "DELETE FROM lyrics WHERE id = (?)", [id]
+    def search_text(
+        self, query: str, limit: int = 20, item_ids: Iterable[int] | None = None
+    ) -> list[tuple[int, str, float]]:
+        """
+        Full-text search of the lyrics, best match first. query uses FTS5 syntax, see fts_query()
+        to build one from plain text. Returns (item_id, id, bm25) rows where a lower bm25 is a
+        better match. item_ids, if given, limits the search to those rows.
+        Ref: https://www.sqlite.org/fts5.html
+        """
+        sql = """SELECT lyrics.item_id, lyrics.id, bm25(lyrics_fts) FROM lyrics_fts
+            JOIN lyrics ON lyrics.item_id = lyrics_fts.rowid WHERE lyrics_fts MATCH ?"""
+        if not query:
+            return []
+        params: list[Any] = [query]
+        if item_ids is not None:
+            item_ids = list(item_ids)
+            if len(item_ids) == 0:
+                return []
+            sql += f" AND lyrics_fts.rowid IN ({','.join('?' * len(item_ids))})"
+            params += item_ids
+        return self.connect().execute(sql + " ORDER BY bm25(lyrics_fts) LIMIT ?", [*params, limit]).fetchall()
+
+    def get_embeddings(self, hashes: Iterable[str], model: str, chunk: int = 500) -> dict[str, bytes]:
+        """Get cached embedding BLOBs for the given text hashes made by model"""
+        hashes = list(hashes)
+        found = {}
+        connection = self.connect()
+        for start in range(0, len(hashes), chunk):
+            batch = hashes[start : start + chunk]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch],
             )
+            found.update(rows)
+        return found
+
+    def insert_embeddings(self, model: str, vectors: Iterable[tuple[str, bytes]]) -> None:
+        self.executemany(
+            "INSERT or IGNORE INTO embeddings(hash, model, vector) VALUES (?, ?, ?)",
+            ((hash, model, vector) for hash, vector in vectors),
+        )
+
+    def remove_lyric(self, id: str) -> None:
+        with self.connect() as connection:
+            connection.execute("DELETE FROM lyrics WHERE id = (?)", [id])
             # doesn't look like there's a way to retrieve that data w/o query select beforehand
-            # response = self.cursor.fetchall()
-    
-    def get_df(self) -> DataFrame:
+
+    def get_df(self) -> "DataFrame":
         """ Get DataFrame from pandas to get embeddings for semantic search"""
-        return read_sql('SELECT * FROM lyrics',self.connect())
-    
+        # imported here so importing the app doesn't pay for pandas, nothing on startup uses it
+        from pandas import read_sql
+
+        return read_sql("SELECT * FROM lyrics", self.connect())
+
+
+def fts_query(text: str, match: str = "all") -> str:
+    """
+    FTS5 query for plain text. match is "all" for rows containing every word, "any" for rows
+    containing at least one (ranked by how well they match, to compare whole lyrics) or "phrase"
+    for the words in order. Words are quoted so punctuation can't be read as query syntax.
+    """
+    words = re.findall(r"\w+", text)
+    if len(words) == 0:
+        return ""
+    if match == "phrase":
+        return '"' + " ".join(words) + '"'
+    if match == "any":
+        return " OR ".join(f'"{word}"' for word in dict.fromkeys(word.lower() for word in words))
+    return " ".join(f'"{word}"' for word in words)
+
 
 if __name__ == "__main__":
     lyrics = LyricDB()
@@ -136,6 +484,9 @@ if __name__ == "__main__":
     print(lyrics.search_lyric(testSong))
     testSong = {"id": 90}
     print(lyrics.search_lyric(testSong))
+    print(lyrics.lookup_many(["23", "90", "missing"]))
+    print(lyrics.search_text(fts_query("23"), limit=5))
     for test in example:
         lyrics.remove_lyric(test["id"])
         print(lyrics.search_lyric(test))
+    lyrics.close()
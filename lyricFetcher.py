@@ -0,0 +1,183 @@
+"""
+Concurrent lyric retrieval from LRCLIB https://lrclib.net/docs
+Fetching one song at a time with a fresh connection each request took up most of the
+response time, so this reuses pooled HTTP connections across a bounded set of worker
+threads, keeps under a request rate with a token bucket and retries 429/5xx responses
+with exponential backoff. Lyrics are written back to the LyricDB in one batch.
+"""
+
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Any, Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lyricDB import LyricDB
+
+type Song = Any
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available then take it"""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class LyricFetcher:
+    BASE_URL = "https://lrclib.net"
+    # "...we encourage you to include the User-Agent header in your requests, specifying your
+    # application's name, version, and a link to its homepage or project page."
+    USER_AGENT = "SpotifyRecommendation v0.1.0 (https://github.com/iinsouciant/SpotifyRecommendation)"
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    # fetches run inside a user's request, so give up rather than wait longer than this
+    MAX_RETRY_AFTER = 10.0
+
+    def __init__(
+        self,
+        database: LyricDB,
+        base_url: str = BASE_URL,
+        max_workers: int = 8,
+        rate: float = 10.0,
+        burst: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+    ) -> None:
+        self.database = database
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+
+        # one keep-alive connection per worker so requests don't redo the TCP/TLS handshake
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = self.USER_AGENT
+
+    def close(self) -> None:
+        self.session.close()
+
+    @staticmethod
+    def searchable(song: Song) -> bool:
+        """False for songs LRCLIB can't be asked about, fetch() always returns None for them"""
+        # artist['name'] can be empty if spotify attributes an album to "Various Artists"
+        # skip for now since it doesn't include any other artist data
+        return len(song["artists"]) > 0 and len(song["artists"][0]["name"]) > 0
+
+    def fetch(self, song: Song) -> str | None:
+        """
+        Look up one song on LRCLIB. Returns the plain lyrics, "" if LRCLIB has none for it,
+        or None if the request failed and the result should not be cached.
+
+        "Attempt to find the best match of lyrics for the track. You must provide the exact signature of the track, including the track title, artist name, album name, and the track's duration in seconds."
+        """
+        if not self.searchable(song):
+            return None
+        params = {
+            "artist_name": song["artists"][0]["name"],
+            "track_name": song["name"],
+            "album_name": song["album"],
+            "duration": song["duration_ms"] // 1000,
+        }
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            delay = self.backoff * 2**attempt * (1 + random.random())
+            try:
+                response = self.session.get(
+                    f"{self.base_url}/api/get", params=params, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                print(f"Error occurred during lyric retrieval for ({song['name']}): {e}")
+                if attempt < self.retries:
+                    sleep(delay)
+                continue
+
+            # if invalid response, can't find song
+            if response.status_code == 404:
+                return ""
+            if response.status_code == 200:
+                try:
+                    return response.json().get("plainLyrics") or ""
+                except ValueError as e:
+                    # truncated body or an HTML error page, don't cache anything for it
+                    print(f"LRCLIB returned an unreadable response for ({song['name']}): {e}")
+                    return None
+            if response.status_code not in self.RETRY_STATUS:
+                print(f"LRCLIB returned {response.status_code} for ({song['name']})")
+                return None
+            if attempt == self.retries:
+                break
+            # respect the server asking us to slow down if it says for how long
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                if float(retry_after) > self.MAX_RETRY_AFTER:
+                    print(f"LRCLIB asked to retry ({song['name']}) after {retry_after}s, giving up")
+                    return None
+                delay = max(delay, float(retry_after))
+            sleep(delay)
+        return None
+
+    def fetch_many(self, songs: Iterable[Song]) -> dict[str, str]:
+        """
+        Fetch lyrics for all songs concurrently, store them on each song and write every
+        definitive result (lyrics or the "" not found sentinel) to the database in one batch.
+        Returns Spotify ID -> lyrics for the songs that resolved.
+        """
+        songs = list(songs)
+        if len(songs) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(songs))) as pool:
+            results = list(pool.map(self.fetch, songs))
+
+        found = {}
+        for song, lyrics in zip(songs, results):
+            if lyrics is None:
+                continue
+            song["lyrics"] = lyrics
+            found[song["id"]] = lyrics
+        self.database.insert_lyric_many(
+            [{"id": id, "plainLyrics": lyrics} for id, lyrics in found.items()]
+        )
+        return found
+
+
+if __name__ == "__main__":
+    db = LyricDB()
+    fetcher = LyricFetcher(db)
+    example = {
+        "id": "example",
+        "name": "I Want to Live",
+        "artists": [{"name": "Borislav Slavov"}],
+        "album": "Baldur's Gate 3 (Original Game Soundtrack)",
+        "duration_ms": 233000,
+        "lyrics": None,
+    }
+    print(fetcher.fetch_many([example]))
+    fetcher.close()
+    db.close()
@@ -0,0 +1,78 @@
+"""
+Lyric preprocessing in front of the embedding model. Lyrics repeat themselves (choruses, ad
+libs, blank lines between stanzas), and the repeats add tokens without adding meaning while
+pushing the end of the song past the model's token window. clean() normalizes whitespace and
+keeps only the first occurrence of each line, so repeated stanzas go too. fit_window() cuts
+what is left to the token window, and length_batches() groups texts of similar token length so
+a batch isn't padded out to its one long song.
+Ref: https://www.sbert.net/examples/applications/computing-embeddings/README.html#input-sequence-length
+"""
+
+import unicodedata
+
+import numpy as np
+
+# part of the identity of stored vectors, change it whenever clean() changes what it returns
+VERSION = "clean1"
+
+
+def clean(text: str | None) -> str:
+    """Normalize whitespace and drop repeated lines, keeping the first occurrence and stanza breaks"""
+    text = unicodedata.normalize("NFKC", text or "")
+    seen = set()
+    lines: list[str] = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if len(line) == 0:
+            # one blank line between stanzas, none for stanzas that were all repeats
+            if len(lines) > 0 and lines[-1] != "":
+                lines.append("")
+            continue
+        key = line.casefold()
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def fit_window(tokenizer, texts: list[str], max_tokens: int) -> tuple[list[str], np.ndarray]:
+    """
+    Cut each text after its first max_tokens tokens and return (texts, token counts). The model
+    would truncate anyway, cutting first gives length_batches() the lengths the model will see.
+    Needs a fast (Rust) tokenizer for character offsets, other tokenizers only count tokens.
+    """
+    if len(texts) == 0:
+        return texts, np.empty(0, dtype=np.int64)
+    encoded = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=max_tokens,
+        return_offsets_mapping=tokenizer.is_fast,
+    )
+    lengths = np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int64)
+    if tokenizer.is_fast:
+        texts = [
+            text[: offsets[-1][1]] if length == max_tokens else text
+            for text, offsets, length in zip(texts, encoded["offset_mapping"], lengths)
+        ]
+    return texts, lengths
+
+
+def length_batches(lengths: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    """Positions of the texts grouped into batches of batch_size, shortest texts first"""
+    order = np.argsort(lengths, kind="stable")
+    return [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+if __name__ == "__main__":
+    song = """Hello   darkness, my old friend
+
+    I've come to talk with you again
+    Hello darkness, my old friend
+
+    Hello darkness, my old friend
+    """
+    print(repr(clean(song)))
+    print(length_batches(np.array([30, 5, 256, 12, 7]), 2))
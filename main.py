@@ -3,19 +3,21 @@ import os
 from time import time
 import base64
 
-import requests
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 from spotipy.cache_handler import FlaskSessionCacheHandler
 
 # for webapps, microframework
 import flask
-from urllib.parse import quote_plus
 
-from SinglyLinkedList import LinkedList
+from SinglyLinkedList import LinkedList, Node
+from pagination import iter_items, iter_pages
 from Stack import Stack
 from lyricDB import LyricDB
+from lyricFetcher import LyricFetcher
 from Recommender import Recommender
+from resultCache import ResultCache
+from tasteProfile import TasteProfiles
 
 from typing import Any, Generator
 
@@ -29,6 +31,9 @@ SCOPES = [
 ]
 
 database = LyricDB()
+# seconds stored track metadata is trusted before it is fetched from Spotify again
+TRACK_TTL = 7 * 24 * 60 * 60
+lyric_fetcher = LyricFetcher(database)
 
 # used for type hints for readability
 type Album = dict[str, str]
@@ -42,7 +47,8 @@ type Artists = list[Artist]
 class Song:
     """
     A simple object to hold 6 different standard text fields. This is essentially a dict
-    with a couple helpful methods.
+    with a couple helpful methods, using __slots__ instead of a per-instance __dict__ since a
+    single request can create thousands of them.
 
     self.name : Song name
     self.artists : list of artist dictionaries from Spotify API
@@ -50,9 +56,10 @@ class Song:
     self.album : Album name
     self.duration_ms : Song duration in ms
     self.lyrics : Plain text lyrics
-    self.database : reference to initialized sqlite3 handler to retrieve lyrics when needed.
     """
 
+    __slots__ = ("name", "artists", "id", "album", "duration_ms", "lyrics")
+
     def __init__(
         self,
         name: str,
@@ -60,7 +67,6 @@ class Song:
         id: str | int,
         album: str,
         duration_ms: int,
-        database: LyricDB,
         lyrics: str | None = None,
     ) -> None:
         self.name = name
@@ -69,7 +75,6 @@ class Song:
         self.album = album
         self.duration_ms = duration_ms
         self.lyrics = lyrics
-        self.database = database
 
     def __getitem__(self, key) -> Any:
         return getattr(self, key)
@@ -92,44 +97,44 @@ class Song:
         GET /api/get?artist_name=Borislav+Slavov&track_name=I+Want+to+Live&album_name=Baldur%27s+Gate+3+(Original+Game+Soundtrack)&duration=233
 
         """
+        # already resolved, e.g. by load_cached_lyrics(). "" means LRCLIB has no lyrics
+        if self.lyrics is not None:
+            return self.lyrics or None
         # Check local lyric database first
         db_response = database.search_lyric(self)
         if db_response == "":
+            self["lyrics"] = ""
             return
         if db_response:
+            self["lyrics"] = db_response
             return db_response
 
-        artist = quote_plus(self["artists"][0]["name"])
-        track = quote_plus(self["name"])
-        album = quote_plus(self["album"])
-        dur = self["duration_ms"] // 1000
-        url = f"https://lrclib.net/api/get?artist_name={artist}&track_name={track}&album_name={album}&duration={dur}"
-        # artist['name'] can be empty if spotify attributes an album to "Various Artists"
-        # skip for now since it doesn't include any other artist data
-        if len(artist) == 0:
-            return
-        # "...If you are developing an application to interact with LRCLIB, we encourage you to include the User-Agent header in your requests, specifying your application's name, version, and a link to its homepage or project page. For example: LRCGET v0.2.0 (https://github.com/tranxuanthang/lrcget)."
-        try:
-            lrc_response = requests.get(
-                url=url,
-                headers={
-                    "LRCGET": "v0.1.0 (https://github.com/iinsouciant/SpotifyRecommendation)"
-                },
-            )
-            # if invalid response, can't find song
-            if lrc_response.status_code == 404:
-                database.insert_lyric(self["id"], "")
-                return
-            lyrics = lrc_response.json()["plainLyrics"]
-            database.insert_lyric(self["id"], lyrics)
+        # fetcher handles session reuse, rate limiting and retries then caches the result
+        lyrics = lyric_fetcher.fetch_many([self]).get(self["id"])
+        if lyrics:
             print(
                 f"Lyrics for {self['name']} by ({self['artists'][0]['name']}) not found in database. Retrieved from API."
             )
-            self["lyrics"] = lyrics
-            return lyrics
-        except Exception as e:
-            print(f"Error occurred during lyric retrieval: {e}")
-            return
+        return lyrics or None
+
+
+def load_cached_lyrics(songs: Songs) -> Songs:
+    """
+    Fill in lyrics for every song the local database already knows about with one batched
+    lookup and return the songs that still have to be fetched from LRCLIB.
+    """
+    cached = database.lookup_many(song["id"] for song in songs if song["lyrics"] is None)
+    unknown = []
+    for song in songs:
+        if song["lyrics"] is not None:
+            continue
+        if song["id"] in cached.hits:
+            song["lyrics"] = cached.hits[song["id"]]
+        elif song["id"] in cached.misses:
+            song["lyrics"] = ""
+        else:
+            unknown.append(song)
+    return unknown
 
 
 class PlaylistLinkedList(LinkedList):
@@ -148,53 +153,49 @@ class PlaylistLinkedList(LinkedList):
         return output
 
     def msort_pls_key(self, key) -> None:
-        """Merge Sort algorithm adapted to Linked Lists according to the given key for each dict element"""
-        # split then sort
-        # split array in two until 1 element arrays, then compare first element of one array to another then merge
-        # base case is if only one element, then we compare
+        """
+        Merge Sort algorithm adapted to Linked Lists according to the given key for each dict element.
+        Sorts in place by relinking the existing nodes, O(n log n) with no new nodes. Each element's
+        key is casefolded once up front instead of on every comparison.
+        """
         if len(self) <= 1:
             return
-        else:
-            mid = len(self) // 2
-            left = PlaylistLinkedList()
-            left.head = self.head
-            current = self.head
-            prev = None
-            i = 0
-            while i < mid and current:
-                prev = current
-                current = current.next
-                i += 1
-
-            # get left and right sections of list
-            right = PlaylistLinkedList()
-            right.head = current
-            prev.next = None
-
-            # sort sections
-            left.msort_pls_key(key)
-            right.msort_pls_key(key)
-
-            result = PlaylistLinkedList()
-            left_current = left.head
-            right_current = right.head
-            while left_current and right_current:
-                # compare first element, append, then increment
-                if left_current.value[key].lower() <= right_current.value[key].lower():
-                    result.append(left_current.value)
-                    left_current = left_current.next
-                else:
-                    result.append(right_current.value)
-                    right_current = right_current.next
-            # when one runs out of elements, need to add the rest of the other
-            while left_current:
-                result.append(left_current.value)
-                left_current = left_current.next
-            while right_current:
-                result.append(right_current.value)
-                right_current = right_current.next
-
-            self.head = result.head
+        keys = {}
+        current = self.head
+        while current is not None:
+            keys[id(current)] = current.value[key].casefold()
+            current = current.next
+        self.head, self.tail = self.__msort(self.head, len(self), keys)
+
+    @staticmethod
+    def __msort(head: Node, n: int, keys: dict[int, str]) -> tuple[Node, Node]:
+        """Sort the n nodes starting at head, returns the new (head, tail)"""
+        # base case is if only one element, it is already sorted
+        if n == 1:
+            head.next = None
+            return head, head
+        # split list in two at the middle, then sort each half
+        mid = n // 2
+        current = head
+        for _ in range(mid - 1):
+            current = current.next
+        right = current.next
+        left, _ = PlaylistLinkedList.__msort(head, mid, keys)
+        right, _ = PlaylistLinkedList.__msort(right, n - mid, keys)
+
+        # compare first node of each half and link the smaller one, <= keeps equal names in order
+        sentinel = tail = Node()
+        while left and right:
+            if keys[id(left)] <= keys[id(right)]:
+                tail.next, left = left, left.next
+            else:
+                tail.next, right = right, right.next
+            tail = tail.next
+        # when one runs out of nodes, link the rest of the other
+        tail.next = left or right
+        while tail.next is not None:
+            tail = tail.next
+        return sentinel.next, tail
 
 
 class SongStack(Stack):
@@ -207,7 +208,8 @@ class SongStack(Stack):
 
 
 def get_secret_key() -> str | None:
-    if load_dotenv() and (os.getenv("SECRET_KEY") is not None):
+    load_dotenv()
+    if os.getenv("SECRET_KEY") is not None:
         return os.getenv("SECRET_KEY")
     raise FileNotFoundError("Missing .env file with SECRET_KEY variable")
 
@@ -228,39 +230,82 @@ def get_oauth(cache_handler) -> SpotifyOAuth:
     return auth
 
 
-def get_song(song_id:str) -> Song:
-    """ Get Song object by Spotify track ID"""
-    res = sp.track(song_id)
-    song = Song(
-        name=res["name"],
-        artists=res["artists"],
-        id=res["id"],
-        album=res["album"]["name"],
-        duration_ms=res["duration_ms"],
-        database=database,
-    )
-    return song
+def get_song(song_id:str) -> Song | None:
+    """ Get Song object by Spotify track ID, None if Spotify has no track with that ID"""
+    songs = get_songs([song_id])
+    return songs[0] if songs else None
+
+
+def get_songs(song_ids: list[str]) -> Songs:
+    """
+    Get Song objects by Spotify track ID in the given order. Metadata comes from the local track
+    cache, only missing or stale (older than TRACK_TTL) tracks are fetched with sp.tracks in
+    batches of 50, the most the endpoint takes per call.
+    """
+    stored = database.get_tracks(song_ids)
+    now = time()
+    stale = [id for id in dict.fromkeys(song_ids) if id not in stored or now - stored[id]["updated_at"] > TRACK_TTL]
+    for start in range(0, len(stale), 50):
+        try:
+            res = sp.tracks(stale[start : start + 50])
+        except Exception as e:
+            # stale metadata is still better than nothing
+            print(f"Error refreshing track metadata: ({e})")
+            continue
+        fresh = [
+            {
+                "id": track["id"],
+                "name": track["name"],
+                "artists": track["artists"],
+                "album": track["album"]["name"],
+                "duration_ms": track["duration_ms"],
+            }
+            for track in res["tracks"]
+            if track is not None
+        ]
+        database.insert_tracks_many(fresh)
+        stored.update((track["id"], track) for track in fresh)
+    return [
+        Song(
+            name=stored[id]["name"],
+            artists=stored[id]["artists"],
+            id=id,
+            album=stored[id]["album"],
+            duration_ms=stored[id]["duration_ms"],
+        )
+        for id in song_ids
+        if id in stored
+    ]
+
+
+def spotify_worker(fetch):
+    """Let pagination worker threads use this request's session, spotipy reads the user's token from it"""
+    if flask.has_request_context():
+        return flask.copy_current_request_context(fetch)
+    return fetch
 
 
 def get_songs_pl(pl_id) -> Generator[Song, Song, Song]:
-    """Generator to get each song from a playlist so that it can be put into different data structures"""
-    offset = 0
-    lim = 100
-    while offset < 501:
-        temp = sp.playlist_tracks(
+    """
+    Generator to get each song from a playlist so that it can be put into different data structures.
+    The first page gives the total track count, the remaining pages are fetched concurrently and
+    songs are yielded in playlist order.
+    """
+    def fetch_page(offset, limit):
+        return sp.playlist_tracks(
             pl_id,
-            fields="items(track(id, name, artists, album(name), duration_ms))",
+            fields="items(track(id, name, artists, album(name), duration_ms)),total",
             offset=offset,
-            limit=lim,
+            limit=limit,
         )
 
-        # if there are no more songs to get, items will be empty list
-        if len(temp["items"]) == 0:
-            offset = 502
-            break
-
+    for temp in iter_pages(fetch_page, limit=100, wrap=spotify_worker):
+        page = []
         for track in temp["items"]:
             songDict = track["track"]
+            # local files and tracks removed from Spotify have no track or id
+            if songDict is None or songDict["id"] is None:
+                continue
             if len(songDict["name"]) == 0:
                 songDict["name"] = "blank"
             song = Song(
@@ -269,12 +314,11 @@ def get_songs_pl(pl_id) -> Generator[Song, Song, Song]:
                 id=songDict["id"],
                 album=songDict["album"]["name"],
                 duration_ms=songDict["duration_ms"],
-                database=database,
             )
-            # song.get_lyrics()
-
-            yield song
-        offset += lim
+            page.append(song)
+        # we already have the metadata, keep it so showing these songs later needs no API call
+        database.insert_tracks_many(page)
+        yield from page
 
 
 def get_songs_album(al_id) -> Generator[Song, Song, Song]:
@@ -287,6 +331,7 @@ def get_songs_album(al_id) -> Generator[Song, Song, Song]:
     )
 
     temp = album["tracks"]["items"]
+    songs = []
     for songDict in temp:
         if len(songDict["name"]) == 0:
             songDict["name"] = "blank"
@@ -296,11 +341,10 @@ def get_songs_album(al_id) -> Generator[Song, Song, Song]:
             id=songDict["id"],
             album=album["name"],
             duration_ms=songDict["duration_ms"],
-            database=database,
         )
-        # song.get_lyrics()
-
-        yield song
+        songs.append(song)
+    database.insert_tracks_many(songs)
+    yield from songs
 
 
 def get_pl_stack(pl_id) -> SongStack:
@@ -381,8 +425,12 @@ cache_handler = FlaskSessionCacheHandler(flask.session)
 sp_oauth = get_oauth(cache_handler)
 sp = Spotify(auth_manager=sp_oauth)
 # maybe combine this stuff into init of a class to make it more organized?
-# song recommender
+# song recommender. cheap to create, the model and index load on first use or in main()
 recommender = Recommender(database)
+# finished recommendations by (playlist, snapshot, index version, n), shared through the database
+result_cache = ResultCache(max_size=256, ttl=60 * 60, database=database)
+# centroid of each playlist's songs, updated by snapshot diff so known playlists need no encoding
+taste_profiles = TasteProfiles(recommender, database)
 
 # first endpoint. want user to see this when they access
 @app.route("/")
@@ -390,6 +438,20 @@ def home():
     return flask.render_template("index.html")
 
 
+@app.route("/ready")
+def ready():
+    """Readiness check, 503 until the recommender's model and index are loaded"""
+    if recommender.ready:
+        return {"ready": True}
+    return {"ready": False}, 503
+
+
+@app.route("/stats")
+def stats():
+    """Recommendation result cache counters"""
+    return result_cache.stats()
+
+
 @app.route("/login")
 def login():
     if not sp_oauth.validate_token(cache_handler.get_cached_token()):
@@ -459,24 +521,18 @@ def user_select_playlist(username):
             flask.url_for("user_select_playlist", username=user["id"])
         )
 
-    offset = 0
-    lim = 50
     pls = PlaylistLinkedList()
-    while True:
-        playlists = sp.current_user_playlists(offset=offset, limit=lim)
-        if len(playlists["items"]) == 0:
-            break
-        for pl in playlists["items"]:
-            if len(pl["name"]) == 0:
-                pl["name"] = "blank"
-            pls.append(
-                {
-                    "name": pl["name"],
-                    "url": pl["external_urls"]["spotify"],
-                    "id": pl["id"],
-                }
-            )
-        offset += lim
+    fetch_page = lambda offset, limit: sp.current_user_playlists(offset=offset, limit=limit)
+    for pl in iter_items(fetch_page, limit=50, wrap=spotify_worker):
+        if len(pl["name"]) == 0:
+            pl["name"] = "blank"
+        pls.append(
+            {
+                "name": pl["name"],
+                "url": pl["external_urls"]["spotify"],
+                "id": pl["id"],
+            }
+        )
 
     pls.msort_pls_key(key="name")
 
@@ -498,48 +554,46 @@ def display_playlist_recommendations(username, pl_id:str, n:int = 10):
         )
 
     try:
-        pl = sp.playlist(pl_id, fields='name,external_urls')
+        pl = sp.playlist(pl_id, fields='name,external_urls,snapshot_id')
         pl_name = pl['name']
         pl_url = pl['external_urls']['spotify']
     except Exception as e:
         print("Error retrieving playlist ("+str(pl_id)+f"): ({e})")
         return flask.redirect(flask.url_for('home'))
-    # songs to feed in to recommendation system
-    selected_songs = get_pl_stack(pl_id)
-    # pull from ?? featured playlists and start getting scores for each track
-    """ note for final report: debated with how to quickly get a bunch of potentially viable songs
-     while considering difficulty and memory space. 
-     considered pulling daily and adding to SQL db but would increase complexity and running out of time
-     even if it may save time trying to pull from API each time.
-     Looking through available methods, will be easier to pull from some featured playlists.
-    """
-    #   make it so user selects number of new releases to check for sinmilarity
-    dataset = []
-    startTime = time()
-    for pl_id in get_new_releases(50):
-        for song in get_songs_album(pl_id):
-            song.get_lyrics()
-            dataset.append(song)
-            print(f"Got lyrics for: ({song['name']}) by ({song['artists'][0]['name']})")
-    linearDur = time() - startTime
-    print(f"\nData set size: {len(dataset)}")
-    print(f"Lyric get time: {linearDur:.9f} seconds\n")
-    # return flask.redirect(flask.url_for('home'))
-    # get i songs from playlist to get recommendations for
-    i = min(30, len(selected_songs))
-    while i >= 0:
-        # need to take care of case where the first 30 songs don't have lyrics
-        i -= 1
-        song:Song = selected_songs.pop()
-        if song is not None and song.get_lyrics():
-            print(f"Got lyrics for: ({song['name']}) by ({song['artists'][0]['name']})")
-            try:
-                recommender.store_score(song['lyrics'])
-            except Exception as e:
-                print(f"Error while getting score for ({song['name']}): ({e})")
-    # semantic search and get song distance to nearest neighbors,
-    # sums distance score in dataset for n songs in selected_songs
-    songs = [get_song(id) for id in recommender.get_recommendations()]
+    # snapshot_id changes whenever the playlist does, so an unchanged playlist can reuse its last result
+    cache_key = (pl_id, pl['snapshot_id'], recommender.version, n)
+    recommendations = result_cache.get(cache_key)
+    if recommendations is not None:
+        songs = get_songs(recommendations)
+        return flask.render_template("recommendations.html", user=user, pl_url=pl_url, pl_name=pl_name, songs=songs)
+
+    # candidates come from the prebuilt catalog. the offline ingestion job (ingest.py) crawls new
+    # releases, resolves their lyrics and updates the index so none of that happens in this request
+    try:
+        profile = taste_profiles.get(pl_id)
+        if profile is None or profile.snapshot_id != pl['snapshot_id']:
+            # the playlist changed since its profile was stored, read its songs to update it
+            selected_songs = get_pl_stack(pl_id)
+            # lyrics of every song the database knows, LRCLIB is only asked about the 30 newest others
+            unknown = load_cached_lyrics(selected_songs.stack)
+            fetched = lyric_fetcher.fetch_many(unknown[-30:])
+            # songs skipped or whose fetch failed are fetched by the next request for this playlist,
+            # songs LRCLIB can't be asked about never will be
+            pending = [song for song in unknown if song["id"] not in fetched and lyric_fetcher.searchable(song)]
+            seeds = [(song["id"], song["lyrics"]) for song in selected_songs.stack if song["lyrics"]]
+            print(f"Updating taste profile of ({pl_name}) from {len(seeds)} songs with lyrics, {len(pending)} still to fetch")
+            profile = taste_profiles.update(pl_id, pl['snapshot_id'], seeds, complete=len(pending) == 0)
+        # one nearest neighbor query for the songs with the lowest total distance to the playlist
+        recommendations = taste_profiles.recommend(profile, n=n)
+        # a profile still missing songs is updated by the next request, don't answer that one from the cache
+        complete = profile.snapshot_id is not None
+    except Exception as e:
+        print(f"Error while getting scores for ({pl_name}): ({e})")
+        recommendations = []
+    if recommendations and complete:
+        result_cache.put(cache_key, recommendations)
+    # metadata comes from the track cache, at most one batched Spotify call for the rest
+    songs = get_songs(recommendations)
     # output html page with links to m songs with the lowest score
     return flask.render_template("recommendations.html", user=user, pl_url=pl_url, pl_name=pl_name, songs=songs)
 
@@ -550,8 +604,14 @@ def logout():
     return flask.redirect(flask.url_for("home"))
 
 
-def main():
-    app.run(debug=True)
+def main(debug: bool = True):
+    # with debug on the reloader runs this file in a watcher process and a serving child process,
+    # only the child (WERKZEUG_RUN_MAIN is set) serves requests and needs the model
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        recommender.start_warm_up()
+        # pick up indexes saved by the ingestion job without restarting
+        recommender.watch(interval=30)
+    app.run(debug=debug)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+"""
+Concurrent reader for Spotify paging objects (https://developer.spotify.com/documentation/web-api/concepts/api-calls#pagination).
+The first page says how many items there are in `total`, so every other page's offset is known
+up front and they can be requested at the same time instead of one after another. Pages are
+still handed back in order so callers see items exactly as Spotify lists them.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator
+
+type Page = dict[str, Any]
+type FetchPage = Callable[[int, int], Page]
+
+
+def iter_pages(
+    fetch_page: FetchPage,
+    limit: int,
+    max_workers: int = 4,
+    wrap: Callable[[FetchPage], FetchPage] | None = None,
+) -> Iterator[Page]:
+    """
+    Yield every page of a paged endpoint in order. fetch_page(offset, limit) makes one request.
+    Up to max_workers pages after the first are fetched concurrently. wrap, if given, is applied
+    to fetch_page for each worker call, e.g. flask.copy_current_request_context so workers can
+    read the user's token from the session.
+    """
+    first = fetch_page(0, limit)
+    yield first
+    total = first.get("total")
+    if total is None:
+        # endpoint didn't say how many there are, fall back to reading until a page comes back empty
+        offset = limit
+        while len(first["items"]) > 0:
+            first = fetch_page(offset, limit)
+            yield first
+            offset += limit
+        return
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            pool.submit(wrap(fetch_page) if wrap else fetch_page, offset, limit)
+            for offset in range(limit, total, limit)
+        ]
+        for future in futures:
+            yield future.result()
+    finally:
+        # if the caller stops early don't keep fetching pages nobody will read
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_items(
+    fetch_page: FetchPage,
+    limit: int,
+    max_workers: int = 4,
+    wrap: Callable[[FetchPage], FetchPage] | None = None,
+) -> Iterator[Any]:
+    """Yield every item of a paged endpoint in order"""
+    for page in iter_pages(fetch_page, limit, max_workers, wrap):
+        yield from page["items"]
@@ -0,0 +1,99 @@
+"""
+Cache of finished recommendation results so reloads, back navigation and several users asking
+about the same playlist don't recompute anything. Keys are
+(playlist id, snapshot_id, index version, n): the snapshot_id changes whenever the playlist is
+edited and the index version whenever the catalog changes, so a hit is always still correct.
+An in-process LRU answers first, an optional SQLite table shares results between processes and
+survives restarts.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable
+
+from lyricDB import LyricDB
+
+type SongIDs = list[str]
+
+
+class ResultCache:
+    def __init__(self, max_size: int = 256, ttl: float = 60 * 60, database: LyricDB | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.database = database
+        self.lock = threading.Lock()
+        # key -> (expires at, Spotify ids), least recently used first
+        self.entries: OrderedDict[Hashable, tuple[float, SongIDs]] = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        if database is not None:
+            database.remove_results(ttl)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def __db_key(key: Hashable) -> str:
+        return json.dumps(key, default=str)
+
+    def get(self, key: Hashable) -> SongIDs | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self.entries[key]
+
+        ids = None
+        if self.database is not None:
+            ids = self.database.get_result(self.__db_key(key), self.ttl)
+        with self.lock:
+            if ids is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self.__store(key, ids)
+        return list(ids)
+
+    def put(self, key: Hashable, ids: SongIDs) -> None:
+        with self.lock:
+            self.__store(key, list(ids))
+        if self.database is not None:
+            self.database.put_result(self.__db_key(key), ids)
+
+    def __store(self, key: Hashable, ids: SongIDs) -> None:
+        """Caller must hold the lock"""
+        self.entries[key] = (monotonic() + self.ttl, ids)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.db_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.db_hits) / lookups if lookups else 0.0,
+            }
+
+
+if __name__ == "__main__":
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.put(("pl", "snap1", "v1", 10), ["a", "b"])
+    print(cache.get(("pl", "snap1", "v1", 10)), cache.get(("pl", "snap2", "v1", 10)))
+    cache.put(("pl2", "snap", "v1", 10), ["c"])
+    cache.put(("pl3", "snap", "v1", 10), ["d"])
+    print(cache.get(("pl", "snap1", "v1", 10)), cache.stats())
@@ -0,0 +1,134 @@
+"""
+Nearest neighbor search backends behind Recommender. Both answer query(vectors, k) with
+(item_ids, distances) shaped like voyager's Index.query, nearest first.
+  VoyagerBackend: approximate HNSW search over a voyager Index, for large catalogs
+  ExactBackend: brute-force search over the embedding vectors held in memory. For a few
+      thousand songs one matrix product is as fast as walking a graph, needs no index build
+      and returns the true nearest neighbors, so it also serves as ground truth for recall
+Ref: https://numpy.org/doc/stable/reference/generated/numpy.argpartition.html
+"""
+
+import numpy as np
+from voyager import Index, Space
+
+from embeddingMatrix import EmbeddingMatrix
+from indexConfig import IndexConfig
+
+
+class SearchBackend:
+    # shown in Recommender.version so results from different backends aren't mixed up
+    name = ""
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def query(self, vectors: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The k nearest item_ids of each vector and their distances. vectors is one vector of
+        shape (dimensions,) or a batch of shape (queries, dimensions) and the results have
+        shape (k,) or (queries, k) to match. k is capped at the number of items.
+        """
+        raise NotImplementedError
+
+    def get_vectors(self, item_ids) -> tuple[np.ndarray, np.ndarray]:
+        """(item_ids, vectors) of the given ids that are stored, in the order given"""
+        raise NotImplementedError
+
+
+class VoyagerBackend(SearchBackend):
+    name = "voyager"
+
+    def __init__(self, index: Index, config: IndexConfig, num_threads: int = -1) -> None:
+        self.index = index
+        self.config = config
+        # threads voyager may use to answer a batch of queries, -1 uses every core
+        self.numThreads = num_threads
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def query(self, vectors: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self.index))
+        return self.index.query(vectors, k, num_threads=self.numThreads, query_ef=self.config.ef(k))
+
+    def get_vectors(self, item_ids) -> tuple[np.ndarray, np.ndarray]:
+        # Float8 / E4M3 indexes hand back their quantized vectors, close enough to query with
+        item_ids = [item_id for item_id in np.asarray(item_ids, dtype=np.int64).tolist() if item_id in self.index]
+        if len(item_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.index.num_dimensions), dtype=np.float32)
+        return np.asarray(item_ids, dtype=np.int64), self.index.get_vectors(item_ids)
+
+
+class ExactBackend(SearchBackend):
+    name = "exact"
+
+    def __init__(self, item_ids, vectors: np.ndarray, space: Space = Space.Cosine, batch_size: int = 256) -> None:
+        self.ids = np.asarray(item_ids, dtype=np.int64)
+        self.vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        self.space = space
+        # queries scored per matrix product, bounds the (batch, items) distance matrix in memory
+        self.batchSize = batch_size
+        if space == Space.Cosine:
+            # normalize once so cosine similarity is a plain dot product
+            self.vectors /= np.linalg.norm(self.vectors, axis=1, keepdims=True).clip(min=1e-12)
+        self.squaredNorms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        # rows in item_id order to look vectors up by item_id
+        self.order = np.argsort(self.ids, kind="stable")
+
+    @classmethod
+    def from_matrix(cls, matrix: EmbeddingMatrix, space: Space = Space.Cosine) -> "ExactBackend":
+        return cls(np.asarray(matrix.ids), np.asarray(matrix.vectors), space)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        """(queries, items) distances, measured the same way voyager measures them in this space"""
+        products = queries @ self.vectors.T
+        if self.space == Space.Cosine:
+            norms = np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+            return 1 - products / norms
+        if self.space == Space.InnerProduct:
+            return 1 - products
+        # voyager's euclidean distance is the squared distance
+        return np.maximum(np.einsum("ij,ij->i", queries, queries)[:, None] - 2 * products + self.squaredNorms, 0)
+
+    def get_vectors(self, item_ids) -> tuple[np.ndarray, np.ndarray]:
+        # cosine vectors come back normalized, which doesn't change their cosine distances
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64), self.vectors[:0]
+        found = self.order[np.searchsorted(self.ids, item_ids, sorter=self.order).clip(max=len(self.ids) - 1)]
+        rows = found[self.ids[found] == item_ids]
+        return self.ids[rows], self.vectors[rows]
+
+    def query(self, vectors: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        k = min(k, len(self.ids))
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries) if k > 0 else 0, self.batchSize):
+            batch = self.distances(queries[start : start + self.batchSize])
+            # k smallest per row without sorting every item, then order just those k
+            if k < len(self.ids):
+                top = np.argpartition(batch, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(k), (len(batch), 1))
+            topDistances = np.take_along_axis(batch, top, axis=1)
+            order = np.argsort(topDistances, axis=1, kind="stable")
+            ids[start : start + len(batch)] = self.ids[np.take_along_axis(top, order, axis=1)]
+            distances[start : start + len(batch)] = np.take_along_axis(topDistances, order, axis=1)
+        if np.ndim(vectors) == 1:
+            return ids[0], distances[0]
+        return ids, distances
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(1000, 8)).astype(np.float32)
+    exact = ExactBackend(np.arange(1000) + 1, vectors)
+    index = IndexConfig().build(8, max_elements=1000)
+    index.add_items(vectors, ids=list(range(1, 1001)))
+    approximate = VoyagerBackend(index, IndexConfig())
+    print(exact.query(vectors[0], 5))
+    print(approximate.query(vectors[0], 5))
@@ -0,0 +1,105 @@
+"""
+Persisted taste profile per playlist: the mean (centroid) of its songs' vectors, how many songs
+went into it and the playlist snapshot_id it matches, stored in the taste_profiles table.
+Recommending from a profile is a single nearest neighbor query with no encoding. For normalized
+vectors in cosine space the songs nearest the centroid are exactly the ones with the lowest
+summed distance to every member of the playlist.
+
+When the playlist's snapshot_id changes the profile is updated incrementally: vectors of songs
+added since are added to the sum and vectors of songs removed are subtracted, so an edit costs
+work proportional to the edit, not the playlist.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from lyricDB import LyricDB
+from Recommender import LyricSet, Recommender, SongIDs
+
+
+class TasteProfile(NamedTuple):
+    centroid: np.ndarray
+    count: int
+    # None while songs of the playlist are still missing from it, so it is updated again
+    snapshot_id: str | None
+    # Spotify IDs of the songs in the centroid
+    members: list[str]
+
+
+class TasteProfiles:
+    def __init__(self, recommender: Recommender, database: LyricDB) -> None:
+        self.recommender = recommender
+        self.database = database
+
+    def get(self, key: str) -> TasteProfile | None:
+        """The stored profile, None if there is none or it was made by a different model"""
+        row = self.database.get_profile(key)
+        if row is None or row[0] != self.recommender.embeddingID:
+            return None
+        model, snapshot_id, centroid, count, members = row
+        return TasteProfile(np.frombuffer(centroid, dtype=np.float64), count, snapshot_id, members)
+
+    def update(self, key: str, snapshot_id: str, seeds: LyricSet, complete: bool = True) -> TasteProfile:
+        """
+        Bring the profile for key up to date with the (id, lyrics) seed rows of the playlist at
+        snapshot_id and store it. Only songs added or removed since the stored snapshot are
+        looked at, unless removed songs' vectors can't be found anymore or most of the playlist
+        changed, then it is computed from scratch.
+        complete is False if some of the playlist's songs are left out of seeds only for now
+        (e.g. their lyrics haven't been fetched yet). The profile is then stored without a
+        snapshot_id, so the next update looks at the playlist again and adds them.
+        """
+        old = self.get(key)
+        if old is not None and old.snapshot_id == snapshot_id:
+            return old
+        current = dict(seeds)
+
+        total = None
+        if old is not None:
+            members = set(old.members)
+            added = [(id, lyrics) for id, lyrics in current.items() if id not in members]
+            removed = [id for id in old.members if id not in current]
+            if len(added) + len(removed) < len(current):
+                removedVectors = self.__stored_vectors(removed)
+                if removedVectors is not None:
+                    total = old.centroid * old.count
+                    total += self.recommender.seed_vectors(added).sum(axis=0, dtype=np.float64)
+                    total -= removedVectors.sum(axis=0, dtype=np.float64)
+                    members = [id for id in old.members if id in current] + [id for id, _ in added]
+        if total is None:
+            members = list(current)
+            total = self.recommender.seed_vectors(list(current.items())).sum(axis=0, dtype=np.float64)
+
+        count = len(members)
+        centroid = total / count if count > 0 else np.zeros(self.recommender.dimensions)
+        snapshot_id = snapshot_id if complete else None
+        self.database.put_profile(key, self.recommender.embeddingID, snapshot_id, centroid.tobytes(), count, members)
+        return TasteProfile(centroid, count, snapshot_id, members)
+
+    def __stored_vectors(self, ids: list[str]) -> np.ndarray | None:
+        """Vectors of songs that left a playlist, None if any can't be found to take them back out"""
+        if len(ids) == 0:
+            return np.empty((0, self.recommender.dimensions), dtype=np.float32)
+        inCatalog = self.recommender.catalog.find(ids) >= 0
+        lyrics = self.database.lookup_many(id for id, known in zip(ids, inCatalog) if not known).hits
+        if any(not known and id not in lyrics for id, known in zip(ids, inCatalog)):
+            return None
+        return self.recommender.seed_vectors([(id, lyrics.get(id)) for id in ids])
+
+    def recommend(self, profile: TasteProfile, n: int = 10) -> SongIDs:
+        """The n songs nearest the centroid that aren't in the playlist already"""
+        if profile.count == 0:
+            return []
+        return self.recommender.nearest(profile.centroid, n, exclude=profile.members)
+
+
+if __name__ == "__main__":
+    db = LyricDB()
+    profiles = TasteProfiles(Recommender(db), db)
+    rows = db.get_all()
+    profile = profiles.update("example", "1", [(id, lyrics) for id, lyrics, _ in rows[10:15]])
+    print(profile.count, profiles.recommend(profile))
+    # one song removed and two added
+    profile = profiles.update("example", "2", [(id, lyrics) for id, lyrics, _ in rows[11:17]])
+    print(profile.count, profiles.recommend(profile))